@@ -0,0 +1,296 @@
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+import numpy as np
+
+from scripts.addlogger import calculate_features, process_data
+from scripts.augmenter import augment_image
+from scripts.classifier import PostureClassifier, feature_matrix
+from scripts.keypointstore import KEYPOINT_NAMES, to_records, keypoint_array
+from scripts.posenet import PoseNetDetector, process_output, decode_keypoints, draw_poses
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, peak memory is not reported there
+    resource = None
+
+class StubInterpreter:
+    """
+    Stand-in for tf.lite.Interpreter with the input and output tensors of PoseNet, for benchmarking without the model.
+
+    Inference returns random keypoints, optionally after sleeping for a fixed time per image
+    to simulate the cost of the model.
+
+    Attributes:
+    - input_shape (numpy.ndarray): Current shape of the input tensor.
+    - latency (float): Simulated inference time per image in seconds.
+    """
+
+    def __init__(self, input_size=192, latency=0.0, seed=0):
+        """
+        Initialize the StubInterpreter.
+
+        Parameters:
+        - input_size (int): Height and width of the input tensor.
+        - latency (float): Simulated inference time per image in seconds.
+        - seed (int): Seed of the generated keypoints.
+
+        Returns:
+        - None
+        """
+        self.input_shape = np.array([1, input_size, input_size, 3])
+        self.latency = latency
+        self._rng = np.random.default_rng(seed)
+        self._output = None
+
+    # Methods of the tf.lite.Interpreter API used by PoseNetDetector
+
+    def allocate_tensors(self):
+        pass
+
+    def get_input_details(self):
+        return [{'index': 0, 'shape': self.input_shape.copy(), 'dtype': np.uint8}]
+
+    def get_output_details(self):
+        return [{'index': 1, 'shape': np.array([self.input_shape[0], 1, 17, 3]), 'dtype': np.float32}]
+
+    def resize_tensor_input(self, index, shape):
+        self.input_shape = np.array(shape)
+
+    def set_tensor(self, index, value):
+        if tuple(value.shape) != tuple(self.input_shape):
+            raise ValueError(f"Expected input of shape {tuple(self.input_shape)}, got {value.shape}")
+
+    def invoke(self):
+        time.sleep(self.latency * self.input_shape[0])
+        self._output = self._rng.random((self.input_shape[0], 1, 17, 3), dtype=np.float32)
+
+    def get_tensor(self, index):
+        return self._output.copy()
+
+def percentiles(samples):
+    """
+    Summarize latency samples.
+
+    Parameters:
+    - samples (list): Latencies in seconds.
+
+    Returns:
+    - dict: Count, mean, p50, p90, p99 and max latency in milliseconds.
+    """
+    samples = np.asarray(samples) * 1000
+    return {
+        'count': len(samples),
+        'mean_ms': float(samples.mean()),
+        'p50_ms': float(np.percentile(samples, 50)),
+        'p90_ms': float(np.percentile(samples, 90)),
+        'p99_ms': float(np.percentile(samples, 99)),
+        'max_ms': float(samples.max()),
+    }
+
+def peak_rss_mb():
+    """
+    Get the peak resident set size of the process.
+
+    Returns:
+    - float: Peak RSS in megabytes, or None if it cannot be measured on this platform.
+    """
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def timed(function, items):
+    """
+    Call a function on every item and measure each call.
+
+    Parameters:
+    - function (callable): Function to benchmark.
+    - items (list): Arguments of the calls.
+
+    Returns:
+    - tuple: Results of the calls, latencies in seconds and the total wall time in seconds.
+    """
+    results, latencies = [], []
+    start = time.perf_counter()
+    for item in items:
+        call_start = time.perf_counter()
+        results.append(function(item))
+        latencies.append(time.perf_counter() - call_start)
+    return results, latencies, time.perf_counter() - start
+
+def synthetic_images(count, height, width, seed=0):
+    """
+    Generate random images.
+
+    Parameters:
+    - count (int): Number of images.
+    - height (int): Image height.
+    - width (int): Image width.
+    - seed (int): Random seed.
+
+    Returns:
+    - list: Images of shape (height, width, 3) and type uint8.
+    """
+    rng = np.random.default_rng(seed)
+    return [rng.integers(0, 256, (height, width, 3), dtype=np.uint8) for _ in range(count)]
+
+def synthetic_keypoints(rows, seed=0):
+    """
+    Generate a random keypoint table.
+
+    Parameters:
+    - rows (int): Number of rows.
+    - seed (int): Random seed.
+
+    Returns:
+    - numpy.ndarray: Structured array with the keypoint store layout.
+    """
+    rng = np.random.default_rng(seed)
+    keypoints = rng.random((rows, len(KEYPOINT_NAMES), 3), dtype=np.float32)
+    return to_records(keypoints, rng.integers(0, 2, rows), [f"img-{i}.jpg" for i in range(rows)])
+
+# Commands timed by cold_start, run from the src folder in a fresh interpreter
+COLD_START_COMMANDS = {
+    'python': ['-c', 'pass'],
+    'index_help': ['index.py', '--help'],
+    'import_posenet': ['-c', 'import scripts.posenet'],
+    'import_augmenter': ['-c', 'import scripts.augmenter'],
+    'import_datagenerator': ['-c', 'import scripts.datagenerator'],
+    'import_addlogger': ['-c', 'import scripts.addlogger'],
+}
+
+def cold_start(runs):
+    """
+    Measure the startup time of the command line entry point and the imports of the pipeline modules.
+
+    Every command runs in a new Python process, so module imports are not shared with this process.
+
+    Parameters:
+    - runs (int): Number of times each command is run.
+
+    Returns:
+    - dict: Median wall time in seconds of each command, or None if the command failed, for example
+      because a dependency is not installed.
+    """
+    src_folder = os.path.dirname(os.path.abspath(__file__))
+    report = {}
+    for name, command in COLD_START_COMMANDS.items():
+        durations = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            completed = subprocess.run([sys.executable, *command], cwd=src_folder, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            if completed.returncode != 0:
+                break
+            durations.append(time.perf_counter() - start)
+        report[name] = float(np.median(durations)) if len(durations) == runs else None
+    return report
+
+def stage_report(latencies, total, units, unit_name):
+    """
+    Build the report of a stage.
+
+    Parameters:
+    - latencies (list): Latency of each call in seconds.
+    - total (float): Total wall time of the stage in seconds.
+    - units (int): Number of processed images or rows.
+    - unit_name (str): 'images' or 'rows'.
+
+    Returns:
+    - dict: Latency percentiles, throughput and peak RSS after the stage.
+    """
+    report = {'latency': percentiles(latencies), 'seconds': total}
+    report[f"{unit_name}_per_sec"] = units / total if total else None
+    report['peak_rss_mb'] = peak_rss_mb()
+    return report
+
+def main(args):
+    """
+    Benchmark the augment, detect, draw and feature stages on synthetic data and print the results as JSON.
+
+    Parameters:
+    - args (argparse.Namespace): Parsed command line arguments.
+
+    Returns:
+    - dict: Benchmark results.
+    """
+    images = synthetic_images(args.images, args.height, args.width, args.seed)
+    results = {'config': vars(args)}
+
+    # Startup time, before this process warms the file system cache any further
+    if args.cold_start_runs:
+        results['cold_start'] = cold_start(args.cold_start_runs)
+
+    # Augmentation, one call per original image
+    _, latencies, total = timed(lambda image: augment_image(image, 'image.jpg', args.augment_count, args.seed), images)
+    results['augment'] = stage_report(latencies, total, len(images) * args.augment_count, 'images')
+
+    # Pose detection with a stub interpreter, one image per call and in batches
+    detector = PoseNetDetector(None, interpreter=StubInterpreter(args.input_size, args.latency, args.seed))
+    outputs, latencies, total = timed(detector.process_image, images)
+    results['detect'] = stage_report(latencies, total, len(images), 'images')
+
+    batches = [images[start:start + args.batch_size] for start in range(0, len(images), args.batch_size)]
+    _, latencies, total = timed(detector.process_batch, batches)
+    results['detect_batch'] = stage_report(latencies, total, len(images), 'images')
+
+    # Keypoint decoding and drawing
+    _, latencies, total = timed(lambda output: [process_output(pose_data) for pose_data in output], outputs)
+    results['process_output'] = stage_report(latencies, total, len(images), 'images')
+
+    _, latencies, total = timed(lambda output: decode_keypoints(output)[:, 0], outputs)
+    results['decode_keypoints'] = stage_report(latencies, total, len(images), 'images')
+
+    _, latencies, total = timed(lambda pair: draw_poses(*pair), list(zip(images, outputs)))
+    results['draw_poses'] = stage_report(latencies, total, len(images), 'images')
+
+    # Feature generation from the keypoint store and from legacy CSV records
+    records = synthetic_keypoints(args.rows, args.seed)
+    chunks = [records[start:start + args.chunk_size] for start in range(0, len(records), args.chunk_size)]
+    _, latencies, total = timed(lambda chunk: calculate_features(keypoint_array(chunk)), chunks)
+    results['features'] = stage_report(latencies, total, len(records), 'rows')
+
+    # Posture scoring straight from keypoints, with a classifier fitted on the first chunk
+    classifier = PostureClassifier.fit(feature_matrix(calculate_features(keypoint_array(chunks[0]))), chunks[0]['Label'])
+    _, latencies, total = timed(lambda chunk: classifier.score(keypoint_array(chunk)), chunks)
+    results['score'] = stage_report(latencies, total, len(records), 'rows')
+
+    legacy = [dict({name: str({'y': y, 'x': x, 'confidence': c}) for name, (y, x, c) in zip(KEYPOINT_NAMES, row)}, Label=label)
+              for row, label in zip(keypoint_array(records[:args.legacy_rows]).tolist(), records['Label'][:args.legacy_rows])]
+    chunks = [legacy[start:start + args.chunk_size] for start in range(0, len(legacy), args.chunk_size)]
+    _, latencies, total = timed(process_data, chunks)
+    results['process_data'] = stage_report(latencies, total, len(legacy), 'rows')
+
+    results['peak_rss_mb'] = peak_rss_mb()
+
+    report = json.dumps(results, indent=2)
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            file.write(report)
+    print(report)
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the augment, detect and feature stages on synthetic data.")
+
+    parser.add_argument('--images', type=int, default=64, help='Number of synthetic images')
+    parser.add_argument('--height', type=int, default=480, help='Height of the synthetic images')
+    parser.add_argument('--width', type=int, default=640, help='Width of the synthetic images')
+    parser.add_argument('--augment_count', type=int, default=5, help='Number of augmented copies for each image')
+    parser.add_argument('--batch_size', type=int, default=8, help='Number of images passed to the detector per inference')
+    parser.add_argument('--input_size', type=int, default=192, help='Input size of the stub interpreter')
+    parser.add_argument('--latency', type=float, default=0.0, help='Simulated inference time per image in seconds')
+    parser.add_argument('--rows', type=int, default=1000000, help='Number of rows of the synthetic keypoint table')
+    parser.add_argument('--legacy_rows', type=int, default=100000, help='Number of rows benchmarked through the legacy CSV records path')
+    parser.add_argument('--chunk_size', type=int, default=10000, help='Number of keypoint rows per feature generation call')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic data')
+    parser.add_argument('--cold_start_runs', type=int, default=3, help='Number of runs of each cold start command, 0 to skip the cold start measurement')
+    parser.add_argument('--output', type=str, default=None, help='Path to also save the results as JSON')
+
+    args = parser.parse_args()
+
+    main(args)
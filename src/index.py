@@ -1,29 +1,158 @@
+import os
 import argparse
-from scripts.addlogger import generate_datasset
-from scripts.augmenter import augment_images
-from scripts.datagenerator import detect_and_save_poses
 
-def main(input_folder, output_folder_augmented, augment_count, output_folder_pose_detected, model_path, csv_path):
-    # Augment images
-    for i in range(2):
-        augment_images(f"{input_folder}/{i}", f"{output_folder_augmented}/{i}", augment_count)
+# Pipeline stages in the order they run
+STAGES = ['augment', 'detect', 'features']
 
-    # Detect and save poses
-    detect_and_save_poses(f"{output_folder_augmented}/0", f"{output_folder_augmented}/1", output_folder_pose_detected, model_path, csv_path)
+def main(args):
+    """
+    Run the pipeline: augment images, detect poses, generate the dataset and optionally train the posture classifier.
 
-    # Generate dataset
-    generate_datasset()
+    Only the stages listed in args.stages run, and the modules of a stage, with heavy dependencies
+    such as imgaug, TensorFlow and pandas, are imported only when that stage runs.
+
+    With args.shard only the images of that shard are processed, and the keypoint store, the
+    dataset and the checkpoints are written to per-shard files, to be merged with merge.py.
+
+    Every stage records its completed work in a manifest in the checkpoint folder, and with
+    --resume the work recorded by an interrupted run is not repeated. Images whose augmented
+    copies are up to date are not augmented again, with or without --resume.
+
+    Parameters:
+    - args (argparse.Namespace): Parsed command line arguments.
+
+    Returns:
+    - None
+    """
+    from scripts import profiler
+    from scripts.checkpoint import StageManifest
+
+    if args.profile:
+        profiler.enable(trace=args.trace_path is not None)
+
+    stages = args.stages.split(',')
+    keypoints_path, dataset_path, csv_path, checkpoint_dir = args.keypoints_path, args.dataset_path, args.csv_path, args.checkpoint_dir
+    if args.shard is not None:
+        from scripts.shard import shard_path
+
+        # Every shard writes its own outputs and checkpoints
+        keypoints_path = shard_path(keypoints_path, args.shard)
+        dataset_path = shard_path(dataset_path, args.shard)
+        csv_path = shard_path(csv_path, args.shard) if csv_path is not None else None
+        checkpoint_dir = os.path.join(checkpoint_dir, f"shard-{args.shard[0]:05d}-of-{args.shard[1]:05d}")
+
+    detect_folders = [f"{args.output_folder_augmented}/{i}" for i in range(2)]
+    options = dict(num_threads=args.num_threads, batch_size=args.batch_size, workers=args.workers,
+                   readers=args.readers, writers=args.writers, queue_size=args.queue_size,
+                   save_annotated=args.save_annotated or not (args.in_memory or args.no_save_annotated),
+                   cache_dir=None if args.no_cache else args.cache_dir, cache_size=args.cache_size_mb << 20,
+                   checkpoint_dir=checkpoint_dir, resume=args.resume, chunk_size=args.chunk_size, shard=args.shard)
+
+    if args.in_memory and 'augment' in stages:
+        # Augment images in memory while detecting poses
+        detect_folders = [f"{args.input_folder}/{i}" for i in range(2)]
+        options.update(augment_count=args.augment_count, seed=args.seed,
+                       output_folder_augmented=args.output_folder_augmented if args.save_augmented else None)
+    elif 'augment' in stages or 'detect' in stages:
+        from scripts.augmenter import augment_images, augmented_sources
+
+        # Entries of the augment manifest are checked against the content of the original images,
+        # so they are kept between runs and unchanged images are not augmented again
+        manifest = StageManifest(os.path.join(checkpoint_dir, 'augment.jsonl'), resume=True)
+        if 'augment' in stages:
+            # Augment images
+            for i in range(2):
+                augment_images(f"{args.input_folder}/{i}", f"{args.output_folder_augmented}/{i}", args.augment_count, args.seed, args.augment_workers, manifest, args.shard)
+
+        # Cache the keypoints of seeded copies by the original images they were created from
+        options.update(sources=augmented_sources(manifest))
+
+    if 'detect' in stages:
+        from scripts.datagenerator import detect_and_save_poses
+
+        # Detect and save poses
+        detect_and_save_poses(*detect_folders, args.output_folder_pose_detected, args.model_path, keypoints_path, csv_path, **options)
+
+    if 'features' in stages:
+        from scripts.addlogger import generate_datasset
+        from scripts.inferencecache import file_hash
+
+        # Generate dataset, unless the same keypoints were already turned into the dataset at this path
+        # and the dataset has not changed since
+        manifest = StageManifest(os.path.join(checkpoint_dir, 'features.jsonl'), args.resume)
+        keypoints_hash = file_hash(keypoints_path)
+        generated = any(keypoints_hash in entry['items'] and entry.get('dataset_path') == os.path.abspath(dataset_path)
+                        and os.path.exists(dataset_path) and entry.get('dataset_hash') == file_hash(dataset_path)
+                        for entry in manifest.entries)
+        if not generated:
+            generate_datasset(keypoints_path, dataset_path, args.chunk_size)
+            manifest.mark([keypoints_hash], dataset_path=os.path.abspath(dataset_path), dataset_hash=file_hash(dataset_path))
+
+    # Train the posture classifier on the dataset
+    if args.classifier_path is not None:
+        from scripts.classifier import train_classifier
+
+        train_classifier(dataset_path, args.classifier_path, seed=args.seed or 0)
+
+    # Report where the time went
+    if args.profile:
+        print(profiler.format_report())
+        if args.trace_path is not None:
+            profiler.save_trace(args.trace_path)
+            print(f"Chrome trace saved to {args.trace_path}")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Process images, augment them, detect poses, and generate a dataset.")
     
+    parser.add_argument('--stages', type=str, default=','.join(STAGES), help='Comma-separated stages to run, out of augment, detect and features')
     parser.add_argument('--input_folder', type=str, default='src/data', help='Folder containing the original images')
     parser.add_argument('--output_folder_augmented', type=str, default='src/output/images/augmented', help='Folder to save the augmented images')
     parser.add_argument('--augment_count', type=int, default=5, help='Number of augmented copies for each image')
+    parser.add_argument('--augment_workers', type=int, default=1, help='Number of processes augmenting images')
+    parser.add_argument('--seed', type=int, default=None, help='Seed for reproducible augmentation')
     parser.add_argument('--output_folder_pose_detected', type=str, default='src/output/images/pose_detected', help='Folder to save the pose-detected images')
     parser.add_argument('--model_path', type=str, default='src/models/PoseNet.tflite', help='Path to the PoseNet TensorFlow Lite model')
-    parser.add_argument('--csv_path', type=str, default='src/output/csv/keypoints.csv', help='Path to save the keypoints CSV file')
+    parser.add_argument('--keypoints_path', type=str, default='src/output/npy/keypoints.npy', help='Path to save the binary keypoint store')
+    parser.add_argument('--csv_path', type=str, default=None, help='Optional path to also export the keypoints in the legacy CSV format')
+    parser.add_argument('--dataset_path', type=str, default='src/output/csv/dataset.csv', help='Path to save the dataset CSV file with the torso features')
+    parser.add_argument('--num_threads', type=int, default=None, help='Number of threads used by the TensorFlow Lite interpreter')
+    parser.add_argument('--batch_size', type=int, default=8, help='Number of images passed to the detector per inference')
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes running pose detection')
+    parser.add_argument('--readers', type=int, default=2, help='Number of threads reading images when running with a single worker')
+    parser.add_argument('--writers', type=int, default=2, help='Number of threads saving pose-detected images when running with a single worker')
+    parser.add_argument('--queue_size', type=int, default=8, help='Maximum number of batches waiting between pipeline stages')
+    parser.add_argument('--in_memory', action='store_true', help='Pass augmented images straight to the detector instead of writing them to disk and reading them back')
+    parser.add_argument('--save_augmented', action='store_true', help='Also save the augmented images when running with --in_memory')
+    parser.add_argument('--cache_dir', type=str, default='src/output/cache', help='Folder of the inference cache')
+    parser.add_argument('--cache_size_mb', type=int, default=1024, help='Maximum size of the inference cache in megabytes')
+    parser.add_argument('--no_cache', action='store_true', help='Detect poses on every image without using the inference cache')
+    parser.add_argument('--checkpoint_dir', type=str, default='src/output/checkpoints', help='Folder of the stage manifests and keypoint parts')
+    parser.add_argument('--resume', action='store_true', help='Continue from the checkpoints of an interrupted run')
+    parser.add_argument('--chunk_size', type=int, default=10000, help='Number of keypoint rows written to disk, and turned into dataset features, at a time')
+    parser.add_argument('--save_annotated', action='store_true', help='Save the pose-detected images, also when running with --in_memory')
+    parser.add_argument('--no_save_annotated', action='store_true', help='Do not save the pose-detected images, which are saved by default unless running with --in_memory')
+    parser.add_argument('--shard', type=str, default=None, help='Process only shard i of N, given as i/N, for a build split across machines or processes')
+    parser.add_argument('--profile', action='store_true', help='Print a per-stage timing breakdown of the run')
+    parser.add_argument('--trace_path', type=str, default=None, help='Optional path to also save a Chrome trace of the run to when running with --profile')
+    parser.add_argument('--classifier_path', type=str, default=None, help='Optional path to train the posture classifier on the dataset and save it (.npz)')
 
     args = parser.parse_args()
 
-    main(args.input_folder, args.output_folder_augmented, args.augment_count, args.output_folder_pose_detected, args.model_path, args.csv_path)
+    unknown = set(args.stages.split(',')) - set(STAGES)
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(sorted(unknown))}")
+
+    if args.save_annotated and args.no_save_annotated:
+        parser.error("--save_annotated and --no_save_annotated cannot be used together")
+
+    if args.shard is not None:
+        from scripts.shard import parse_shard
+
+        try:
+            args.shard = parse_shard(args.shard)
+        except ValueError as error:
+            parser.error(f"invalid --shard {args.shard}: {error}")
+        if args.classifier_path is not None:
+            parser.error("--classifier_path needs the whole dataset, pass it to merge.py instead of the shards")
+
+    main(args)
@@ -0,0 +1,51 @@
+import sys
+import json
+import argparse
+
+from scripts.shard import merge_shards
+
+def main(args):
+    """
+    Merge the keypoint stores and datasets of all shards of a sharded build and write the checksum manifest.
+
+    Parameters:
+    - args (argparse.Namespace): Parsed command line arguments.
+
+    Returns:
+    - dict: Checksum manifest.
+    """
+    manifest = merge_shards(args.shards, args.keypoints_path, args.dataset_path, args.manifest_path)
+
+    # Export the merged keypoints to the legacy CSV format if requested
+    if args.csv_path is not None:
+        from scripts.keypointstore import load_keypoints, export_csv
+
+        export_csv(load_keypoints(args.keypoints_path), args.csv_path)
+
+    # Train the posture classifier on the merged dataset
+    if args.classifier_path is not None:
+        from scripts.classifier import train_classifier
+
+        train_classifier(args.dataset_path, args.classifier_path, seed=args.seed)
+
+    print(json.dumps({'keypoints': manifest['keypoints'], 'dataset': manifest['dataset']}, indent=2))
+    return manifest
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merge the keypoint stores and datasets written by the shards of index.py --shard i/N.")
+
+    parser.add_argument('--shards', type=int, required=True, help='Number of shards N the build was split into')
+    parser.add_argument('--keypoints_path', type=str, default='src/output/npy/keypoints.npy', help='Path to the merged keypoint store, as passed to the shards')
+    parser.add_argument('--dataset_path', type=str, default='src/output/csv/dataset.csv', help='Path to the merged dataset CSV file, as passed to the shards')
+    parser.add_argument('--manifest_path', type=str, default=None, help='Path to the checksum manifest, next to the keypoint store by default')
+    parser.add_argument('--csv_path', type=str, default=None, help='Optional path to also export the merged keypoints in the legacy CSV format')
+    parser.add_argument('--classifier_path', type=str, default=None, help='Optional path to train the posture classifier on the merged dataset and save it (.npz)')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the classifier train/test split')
+
+    args = parser.parse_args()
+
+    # Incomplete or mismatched shards are listed in the manifest and fail the merge
+    try:
+        main(args)
+    except ValueError as error:
+        sys.exit(f"Shards not merged: {error}")
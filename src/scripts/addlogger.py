@@ -1,6 +1,16 @@
+import os
 import numpy as np
 import pandas as pd
 
+from scripts.keypointstore import KEYPOINT_PATTERN, iter_keypoints, keypoint_array, to_records
+from scripts import profiler
+
+# Indices of the torso keypoints in the PoseNet output (17 keypoints, each stored as 'y', 'x', 'confidence')
+LEFT_SHOULDER = 5
+RIGHT_SHOULDER = 6
+LEFT_HIP = 11
+RIGHT_HIP = 12
+
 def calculate_torso_area(left_hip, right_hip, left_shoulder, right_shoulder):
     """
     Calculate the area of the torso using the trapezoid formula.
@@ -113,6 +123,100 @@ def calculate_perpendicular_distance(left_hip, right_hip, left_shoulder, right_s
     distances = np.linalg.norm(np.array([perpendicular_x, perpendicular_y]) - np.array(hip_midpoint), axis=0)
     return distances
 
+def calculate_features(keypoints):
+    """
+    Calculate torso area, perpendicular distances, and angle for a batch of poses at once.
+
+    The formulas are the same as in calculate_torso_area, calculate_perpendicular_distance and
+    calculate_angle, evaluated with array operations over all rows. Where the scalar functions
+    divide by zero, a vertical hip or shoulder line, and a horizontal hip line for the angle, raise
+    ZeroDivisionError, since those slopes are divided as Python floats. Parallel hip and shoulder
+    lines do not raise: calculate_perpendicular_distance divides a NumPy array by zero there and
+    returns inf. Here the values of all these rows are NaN instead.
+
+    Parameters:
+    - keypoints (numpy.ndarray): Array of shape (N, 17, 3) with 'y', 'x' and 'confidence' values for each keypoint.
+
+    Returns:
+    - dict: Arrays of shape (N,) for 'Torso Area', 'Perpendicular Distance Left Shoulder',
+      'Perpendicular Distance Right Shoulder' and 'Angle Degree'.
+    """
+
+    keypoints = np.asarray(keypoints, dtype=np.float64)
+
+    # Extract (x, y) coordinates of the torso keypoints
+    left_hip_x, left_hip_y = keypoints[:, LEFT_HIP, 1], keypoints[:, LEFT_HIP, 0]
+    right_hip_x, right_hip_y = keypoints[:, RIGHT_HIP, 1], keypoints[:, RIGHT_HIP, 0]
+    left_shoulder_x, left_shoulder_y = keypoints[:, LEFT_SHOULDER, 1], keypoints[:, LEFT_SHOULDER, 0]
+    right_shoulder_x, right_shoulder_y = keypoints[:, RIGHT_SHOULDER, 1], keypoints[:, RIGHT_SHOULDER, 0]
+
+    # Torso area using the trapezoid formula
+    left_base = np.hypot(left_hip_x - left_shoulder_x, left_hip_y - left_shoulder_y)
+    right_base = np.hypot(right_hip_x - right_shoulder_x, right_hip_y - right_shoulder_y)
+    height = np.abs(left_shoulder_y - left_hip_y)
+    torso_area = ((left_base + right_base) * height) / 2
+
+    # Rows where the slopes of the hip and shoulder lines are defined
+    hip_dx = right_hip_x - left_hip_x
+    shoulder_dx = right_shoulder_x - left_shoulder_x
+    slopes_defined = (hip_dx != 0) & (shoulder_dx != 0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Midpoint of the hips and slopes of the hip and shoulder lines
+        hip_midpoint_x = (left_hip_x + right_hip_x) / 2
+        hip_midpoint_y = (left_hip_y + right_hip_y) / 2
+        hip_slope = (right_hip_y - left_hip_y) / hip_dx
+        shoulder_slopes = (right_shoulder_y - left_shoulder_y) / shoulder_dx
+
+        # Perpendicular distances from the midpoint of the hips to the shoulder lines
+        hip_intercept = hip_midpoint_y - hip_slope * hip_midpoint_x
+        shoulder_intercepts = np.stack([left_shoulder_y - shoulder_slopes * left_shoulder_x,
+                                        right_shoulder_y - shoulder_slopes * right_shoulder_x])
+        slope_difference = hip_slope - shoulder_slopes
+        perpendicular_x = (shoulder_intercepts - hip_intercept) / slope_difference
+        perpendicular_y = hip_slope * perpendicular_x + hip_intercept
+        # calculate_perpendicular_distance subtracts the midpoint from the stacked (x, y) intersections
+        # by broadcasting, which pairs the left intersection with the midpoint 'x' and the right one
+        # with the midpoint 'y'; the same pairing is kept here so the dataset values do not change
+        hip_midpoint = np.stack([hip_midpoint_x, hip_midpoint_y])
+        distances = np.hypot(perpendicular_x - hip_midpoint, perpendicular_y - hip_midpoint)
+        distances[:, ~(slopes_defined & (slope_difference != 0))] = np.nan
+
+        # Angle between the torso and the shoulder line using the cosine rule
+        intersection_x = (hip_midpoint_y - left_shoulder_y + hip_slope * left_shoulder_x) / hip_slope
+        intersection_y = left_shoulder_y + (intersection_x - left_shoulder_x) * shoulder_slopes
+        a = np.hypot(intersection_x - hip_midpoint_x, intersection_y - hip_midpoint_y)
+        b = np.hypot(shoulder_dx, right_shoulder_y - left_shoulder_y)
+        dot = (intersection_x - hip_midpoint_x) * shoulder_dx + (intersection_y - hip_midpoint_y) * (right_shoulder_y - left_shoulder_y)
+        angle_deg = np.degrees(np.arccos(np.clip(dot / (a * b), -1.0, 1.0)))
+        angle_deg[~(slopes_defined & (hip_slope != 0))] = np.nan
+
+    return {
+        'Torso Area': torso_area,
+        'Perpendicular Distance Left Shoulder': distances[0],
+        'Perpendicular Distance Right Shoulder': distances[1],
+        'Angle Degree': angle_deg,
+    }
+
+def keypoints_from_frame(df):
+    """
+    Build a keypoints array from a DataFrame with stringified keypoint dicts, as written to keypoints.csv.
+
+    Only the torso keypoints used by calculate_features are parsed, the remaining ones are NaN.
+
+    Parameters:
+    - df (pandas.DataFrame): DataFrame with 'Left Hip', 'Right Hip', 'Left Shoulder' and 'Right Shoulder' columns.
+
+    Returns:
+    - numpy.ndarray: Array of shape (N, 17, 3) with 'y', 'x' and 'confidence' values for each keypoint.
+    """
+
+    keypoints = np.full((len(df), 17, 3), np.nan)
+    for index, column in ((LEFT_HIP, 'Left Hip'), (RIGHT_HIP, 'Right Hip'),
+                          (LEFT_SHOULDER, 'Left Shoulder'), (RIGHT_SHOULDER, 'Right Shoulder')):
+        keypoints[:, index] = df[column].astype(str).str.extract(KEYPOINT_PATTERN).to_numpy(dtype=np.float64)
+    return keypoints
+
 def process_data(data):
     """
     Process the input data to calculate torso area, perpendicular distances, and angle for each entry.
@@ -124,34 +228,67 @@ def process_data(data):
     - list: List of dictionaries containing processed data.
     """
 
-    results = []
-
-    for entry in data:
-        # Convert string representations of dictionaries to actual dictionaries
-        left_hip = eval(entry['Left Hip'])
-        right_hip = eval(entry['Right Hip'])
-        left_shoulder = eval(entry['Left Shoulder'])
-        right_shoulder = eval(entry['Right Shoulder'])
-        label = entry['Label']
-
-        # Calculate torso area, perpendicular distances, and angle
-        torso_area = calculate_torso_area(left_hip, right_hip, left_shoulder, right_shoulder)
-        distances = calculate_perpendicular_distance(left_hip, right_hip, left_shoulder, right_shoulder)
-        angle_deg = calculate_angle(left_hip, right_hip, left_shoulder, right_shoulder)
-
-        # Append the results to the list
-        results.append({
-            'Torso Area': torso_area,
-            'Perpendicular Distance Left Shoulder': distances[0],
-            'Perpendicular Distance Right Shoulder': distances[1],
-            'Angle Degree': angle_deg,
-            'Target': label
-        })
-
-    return results
-
-def generate_datasset():
-    df = pd.read_csv('src\output\csv\keypoints.csv')
-    processed_data = process_data(df.to_dict(orient='records'))
-    results_df = pd.DataFrame(processed_data)
-    results_df.to_csv('src\output\csv\dataset.csv', index=False)
+    if not len(data):
+        return []
+
+    with profiler.timer('process_data.parse'):
+        df = pd.DataFrame(data)
+        keypoints = keypoints_from_frame(df)
+    with profiler.timer('process_data.features'):
+        results_df = pd.DataFrame(calculate_features(keypoints))
+    results_df['Target'] = df['Label'].to_numpy()
+    return results_df.to_dict(orient='records')
+
+def append_features(records, dataset_path, header):
+    """
+    Calculate the torso features of a block of keypoint rows and append them to the dataset CSV file.
+
+    Parameters:
+    - records (numpy.ndarray): Structured array with the keypoint store layout.
+    - dataset_path (str): Path to the dataset CSV file.
+    - header (bool): Whether this is the first block, which replaces the file and writes the header line.
+
+    Returns:
+    - None
+    """
+    with profiler.timer('generate_datasset.features'):
+        results_df = pd.DataFrame(calculate_features(keypoint_array(records)))
+    results_df['Target'] = records['Label']
+    with profiler.timer('generate_datasset.write'):
+        results_df.to_csv(dataset_path, index=False, mode='w' if header else 'a', header=header)
+
+def generate_datasset(keypoints_path=os.path.join('src', 'output', 'npy', 'keypoints.npy'),
+                      dataset_path=os.path.join('src', 'output', 'csv', 'dataset.csv'), chunk_size=100000):
+    """
+    Calculate the torso features for every row of a keypoint store and save them as the dataset CSV file.
+
+    The keypoints are read chunk_size rows at a time, and the features of each block are appended
+    to the dataset before the next block is read, so memory use depends on the chunk size and not
+    on the size of the keypoint store.
+
+    Parameters:
+    - keypoints_path (str): Path to the keypoint store (.npy) or a legacy keypoints CSV file.
+    - dataset_path (str): Path to the dataset CSV file.
+    - chunk_size (int): Number of keypoint rows processed at a time.
+
+    Returns:
+    - int: Number of rows written to the dataset.
+    """
+    directory = os.path.dirname(dataset_path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+
+    chunks = iter_keypoints(keypoints_path, chunk_size)
+    rows = 0
+    while True:
+        with profiler.timer('generate_datasset.load'):
+            records = next(chunks, None)
+        if records is None:
+            break
+        append_features(records, dataset_path, header=rows == 0)
+        rows += len(records)
+
+    # An empty store still gets a dataset with the header line
+    if not rows:
+        append_features(to_records(np.zeros((0, 17, 3)), [], []), dataset_path, header=True)
+    return rows
@@ -1,8 +1,155 @@
 import os
-import imgaug.augmenters as iaa
+import zlib
+import threading
+import functools
+import multiprocessing
+import numpy as np
 import cv2
 
-def augment_images(input_folder, output_folder, augment_count):
+from scripts import profiler
+from scripts.shard import in_shard
+from scripts.inferencecache import file_hash
+
+# Augmentation sequence of each thread, imgaug sequences keep random state and are not shared between threads
+_local = threading.local()
+
+def augmentation_sequence():
+    """
+    Get the augmentation sequence of the current thread.
+
+    Returns:
+    - imgaug.augmenters.Sequential: Augmentation sequence.
+    """
+    if not hasattr(_local, 'seq'):
+        # imgaug is slow to import, so it is only loaded once images are augmented
+        import imgaug.augmenters as iaa
+
+        # Define the augmentation sequence
+        _local.seq = iaa.Sequential([
+            iaa.Fliplr(0.5),  # Random horizontal flip
+            iaa.Affine(rotate=(-10, 10)),  # Random rotation between -10 to 10 degrees
+            iaa.GaussianBlur(sigma=(0, 1.0)),  # Random blur
+            iaa.AdditiveGaussianNoise(scale=(0, 0.05 * 255)),  # Add random Gaussian noise
+        ])
+    return _local.seq
+
+def augmented_name(filename, i):
+    """
+    Get the file name of an augmented copy of an image.
+
+    Parameters:
+    - filename (str): File name of the original image.
+    - i (int): Index of the augmented copy, starting from 0.
+
+    Returns:
+    - str: File name of the augmented copy.
+    """
+    return f"{filename.split('.')[0]}_aug_{i+1}.jpg"
+
+def image_seed(seed, image):
+    """
+    Derive the random seed for augmenting an image from the run seed and the image content.
+
+    Parameters:
+    - seed (int): Seed of the run.
+    - image (numpy.ndarray): Original image.
+
+    Returns:
+    - int: Seed for the augmentation sequence.
+    """
+    return (seed + zlib.crc32(np.ascontiguousarray(image).data)) % 2**31
+
+def augment_image(image, filename, augment_count, seed=None):
+    """
+    Create augmented copies of an image in memory.
+
+    All copies are stacked into one array and augmented with a single call of the sequence.
+    With a seed the copies depend only on the seed and the image content, not on the order
+    or the thread the images are augmented in.
+
+    Parameters:
+    - image (numpy.ndarray): Original image.
+    - filename (str): File name of the original image.
+    - augment_count (int): Number of augmented copies to create.
+    - seed (int, optional): Seed of the run for reproducible augmentation.
+
+    Returns:
+    - list: Pairs of file name and augmented image for each copy.
+    """
+    # Without copies there is nothing to augment, and np.stack fails on an empty list
+    if augment_count <= 0:
+        return []
+
+    seq = augmentation_sequence()
+    if seed is not None:
+        seq.seed_(image_seed(seed, image))
+
+    augmented_images = seq(images=np.stack([image] * augment_count))
+    return [(augmented_name(filename, i), augmented_image) for i, augmented_image in enumerate(augmented_images)]
+
+def augment_file(task):
+    """
+    Augment one image file and save its augmented copies.
+
+    Parameters:
+    - task (tuple): Input folder, output folder, file name, number of augmented copies and seed.
+
+    Returns:
+    - str: Path to the original image.
+    """
+    input_folder, output_folder, filename, augment_count, seed = task
+    with profiler.timer('imread'):
+        image = cv2.imread(os.path.join(input_folder, filename))
+
+    # Apply augmentation and save the augmented images
+    with profiler.timer('augment'):
+        augmented_images = augment_image(image, filename, augment_count, seed)
+    for augmented_filename, augmented_image in augmented_images:
+        output_path = os.path.join(output_folder, augmented_filename)
+        with profiler.timer('imwrite'):
+            cv2.imwrite(output_path, augmented_image)
+
+    return os.path.join(input_folder, filename)
+
+def is_augmented(entry, record):
+    """
+    Check whether the augmented copies of an image recorded in the augment manifest are up to date.
+
+    Parameters:
+    - entry (dict, optional): Entry of the image in the augment manifest, None if it is not recorded.
+    - record (dict): Content hash of the image, number of copies, seed and paths of the copies of the current run.
+
+    Returns:
+    - bool: True if the copies were created from the same content with the same parameters and all of them exist.
+    """
+    if entry is None or any(entry.get(name) != value for name, value in record.items()):
+        return False
+    return all(os.path.exists(path) for path in entry['outputs'])
+
+def augmented_sources(manifest):
+    """
+    Map the augmented copies recorded in the augment manifest to the image they were created from.
+
+    Only seeded copies are mapped, since they depend on nothing but the seed and the content of the
+    original image, so their keypoints can be cached by it. Unseeded copies are cached by their own content.
+
+    Parameters:
+    - manifest (StageManifest): Manifest of the augment stage.
+
+    Returns:
+    - dict: SHA-256 hash of the original image, number of augmented copies, seed and index of the copy, by path of the copy.
+    """
+    sources = {}
+    for entry in manifest.entries:
+        for i, path in enumerate(entry.get('outputs', [])):
+            if entry['seed'] is None:
+                # A later unseeded run replaced the copy
+                sources.pop(path, None)
+            else:
+                sources[path] = (entry['source'], entry['augment_count'], entry['seed'], i)
+    return sources
+
+def augment_images(input_folder, output_folder, augment_count, seed=None, processes=1, manifest=None, shard=None):
     """
     Augment images in the input folder and save the augmented images to the output folder.
 
@@ -10,6 +157,10 @@ def augment_images(input_folder, output_folder, augment_count):
     - input_folder (str): Path to the folder containing the original images.
     - output_folder (str): Path to the folder where augmented images will be saved.
     - augment_count (int): Number of augmented copies to create for each image.
+    - seed (int, optional): Seed for reproducible augmentation.
+    - processes (int): Number of processes augmenting images.
+    - manifest (StageManifest, optional): Manifest of the augment stage, images recorded in it with the same content and parameters are skipped and newly augmented ones are added.
+    - shard (tuple, optional): Index and number of shards, to augment only the images of one shard.
 
     Returns:
     - None
@@ -19,25 +170,41 @@ def augment_images(input_folder, output_folder, augment_count):
     if not os.path.exists(output_folder):
         os.makedirs(output_folder)
 
-    # Define the augmentation sequence
-    seq = iaa.Sequential([
-        iaa.Fliplr(0.5),  # Random horizontal flip
-        iaa.Affine(rotate=(-10, 10)),  # Random rotation between -10 to 10 degrees
-        iaa.GaussianBlur(sigma=(0, 1.0)),  # Random blur
-        iaa.AdditiveGaussianNoise(scale=(0, 0.05 * 255)),  # Add random Gaussian noise
-    ])
-
     # Iterate through all images in the input folder
-    for filename in os.listdir(input_folder):
-        if filename.endswith(".jpg") or filename.endswith(".png"):
-            image_path = os.path.join(input_folder, filename)
-            image = cv2.imread(image_path)
-
-            # Apply augmentation and save the augmented images
-            for i in range(augment_count):
-                augmented_image = seq(image=image)
-                output_path = os.path.join(output_folder, f"{filename.split('.')[0]}_aug_{i+1}.jpg")
-                cv2.imwrite(output_path, augmented_image)
+    tasks = [(input_folder, output_folder, filename, augment_count, seed)
+             for filename in os.listdir(input_folder) if (filename.endswith(".jpg") or filename.endswith(".png")) and in_shard(filename, shard)]
+    if manifest is not None:
+        # Describe the copies of every image as they are recorded in the manifest
+        records = {}
+        for task in tasks:
+            records[os.path.join(input_folder, task[2])] = {
+                'source': file_hash(os.path.join(input_folder, task[2])),
+                'augment_count': augment_count,
+                'seed': seed,
+                'outputs': [os.path.join(output_folder, augmented_name(task[2], i)) for i in range(augment_count)],
+            }
+
+        # Images whose copies were created from the same content with the same parameters are not augmented again,
+        # so the copies, and the cache keys of their keypoints, stay the same from run to run
+        recorded = {entry['items'][0]: entry for entry in manifest.entries}
+        tasks = [task for task in tasks if not is_augmented(recorded.get(os.path.join(input_folder, task[2])), records[os.path.join(input_folder, task[2])])]
+
+    if processes > 1:
+        # Seeds are derived per image, so the result does not depend on how the images are shared out
+        with multiprocessing.get_context('spawn').Pool(processes, initializer=profiler.configure, initargs=profiler.options()) as pool:
+            if profiler.enabled():
+                # Workers send back what they recorded along with every result
+                image_paths = profiler.merge_results(pool.imap(functools.partial(profiler.collecting, augment_file), tasks))
+            else:
+                image_paths = pool.imap(augment_file, tasks)
+            for image_path in image_paths:
+                if manifest is not None:
+                    manifest.mark([image_path], **records[image_path])
+    else:
+        for task in tasks:
+            image_path = augment_file(task)
+            if manifest is not None:
+                manifest.mark([image_path], **records[image_path])
 
 if __name__ == "__main__":
     input_folder = "downloaded_files/source data/1"  # Folder containing the original images
@@ -0,0 +1,157 @@
+import os
+import json
+import numpy as np
+
+from scripts.keypointstore import save_keypoints
+
+class StageManifest:
+    """
+    Class for recording the items a pipeline stage has completed, so an interrupted run can be resumed.
+
+    The manifest is a JSON lines file, every line lists a group of completed items together with
+    any extra information about them, such as the part file their results were written to.
+
+    Attributes:
+    - path (str): Path to the manifest file.
+    - entries (list): Recorded entries in the order they were completed.
+    - completed (set): All completed items.
+    """
+
+    def __init__(self, path, resume=False):
+        """
+        Initialize the StageManifest, loading the recorded entries when resuming.
+
+        Parameters:
+        - path (str): Path to the manifest file.
+        - resume (bool): Whether to keep the entries of an earlier run instead of starting over.
+
+        Returns:
+        - None
+        """
+        self.path = path
+        self.entries = []
+        self.completed = set()
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        if resume and os.path.exists(path):
+            with open(path) as file:
+                for line in file:
+                    # A line cut short by a crash is not a completed entry
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        break
+                    self.entries.append(entry)
+                    self.completed.update(entry['items'])
+
+        # Rewrite the manifest so that it holds exactly the loaded entries
+        with open(path, 'w') as file:
+            for entry in self.entries:
+                file.write(json.dumps(entry) + '\n')
+
+    def mark(self, items, **extra):
+        """
+        Record a group of items as completed.
+
+        Parameters:
+        - items (list): Completed items.
+        - extra: Additional information stored with the entry.
+
+        Returns:
+        - None
+        """
+        entry = dict(extra, items=list(items))
+        with open(self.path, 'a') as file:
+            file.write(json.dumps(entry) + '\n')
+            file.flush()
+            os.fsync(file.fileno())
+
+        self.entries.append(entry)
+        self.completed.update(entry['items'])
+
+class KeypointPartWriter:
+    """
+    Class for appending detected keypoints to disk in part files of a fixed number of rows.
+
+    A part is recorded in the manifest together with the input files whose keypoints it holds
+    only after it has been written, so a part left behind by a crash is simply overwritten on resume.
+
+    Attributes:
+    - parts_dir (str): Folder the part files are written to.
+    - manifest (StageManifest): Manifest of the detect stage.
+    - chunk_size (int): Number of rows per part file.
+    """
+
+    def __init__(self, parts_dir, manifest, chunk_size=10000):
+        """
+        Initialize the KeypointPartWriter.
+
+        Parameters:
+        - parts_dir (str): Folder the part files are written to.
+        - manifest (StageManifest): Manifest of the detect stage.
+        - chunk_size (int): Number of rows per part file.
+
+        Returns:
+        - None
+        """
+        self.parts_dir = parts_dir
+        self.manifest = manifest
+        self.chunk_size = chunk_size
+        self._clear()
+
+    def _clear(self):
+        self.items = []
+        self.keypoints = []
+        self.labels = []
+        self.sources = []
+        self.rows = 0
+
+    def add(self, items, keypoints, labels, sources):
+        """
+        Add the keypoints detected for a group of input files, writing a part once enough rows are buffered.
+
+        Parameters:
+        - items (list): Input files the rows were detected on.
+        - keypoints (numpy.ndarray): Keypoint array of shape (N, 17, 3).
+        - labels (list): Class label of each row.
+        - sources (list): Name of the image each row was detected on.
+
+        Returns:
+        - None
+        """
+        self.items += items
+        self.keypoints.append(keypoints)
+        self.labels += labels
+        self.sources += sources
+        self.rows += len(keypoints)
+
+        if self.rows >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the buffered rows to a new part file and record it in the manifest.
+
+        Returns:
+        - None
+        """
+        if not self.items:
+            return
+
+        part = f"part-{len(self.manifest.entries):05d}.npy"
+        keypoints = np.concatenate(self.keypoints).reshape(-1, 17, 3)
+        save_keypoints(os.path.join(self.parts_dir, part), keypoints, self.labels, self.sources)
+        self.manifest.mark(self.items, part=part)
+        self._clear()
+
+    def parts(self):
+        """
+        Get the paths of all recorded part files in the order they were written.
+
+        Returns:
+        - list: Paths to the part files.
+        """
+        return [os.path.join(self.parts_dir, entry['part']) for entry in self.manifest.entries]
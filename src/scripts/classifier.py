@@ -0,0 +1,208 @@
+import os
+import numpy as np
+import pandas as pd
+
+from scripts.addlogger import calculate_features
+
+# Columns of the dataset generated by generate_datasset, in the order the classifier uses them
+FEATURE_NAMES = ['Torso Area', 'Perpendicular Distance Left Shoulder', 'Perpendicular Distance Right Shoulder', 'Angle Degree']
+
+def sigmoid(z):
+    # The tanh form does not overflow for large negative z
+    return 0.5 * (1 + np.tanh(0.5 * z))
+
+def feature_matrix(features):
+    """
+    Stack torso features into a matrix.
+
+    Parameters:
+    - features (dict or pandas.DataFrame): Arrays of the torso features, as returned by calculate_features.
+
+    Returns:
+    - numpy.ndarray: Array of shape (N, 4) with the features in the order of FEATURE_NAMES.
+    """
+    return np.column_stack([np.asarray(features[name], dtype=np.float64) for name in FEATURE_NAMES])
+
+class PostureClassifier:
+    """
+    Logistic regression classifier of the torso posture, predicting the label of a pose from its torso features.
+
+    Features are standardized with the statistics of the training data, and missing features
+    of degenerate poses are replaced with the training mean.
+
+    Attributes:
+    - mean (numpy.ndarray): Mean of each feature on the training data.
+    - scale (numpy.ndarray): Standard deviation of each feature on the training data.
+    - weights (numpy.ndarray): Weight of each standardized feature.
+    - bias (float): Intercept.
+    """
+
+    def __init__(self, mean, scale, weights, bias):
+        """
+        Initialize the PostureClassifier with fitted parameters.
+
+        Parameters:
+        - mean (numpy.ndarray): Mean of each feature on the training data.
+        - scale (numpy.ndarray): Standard deviation of each feature on the training data.
+        - weights (numpy.ndarray): Weight of each standardized feature.
+        - bias (float): Intercept.
+
+        Returns:
+        - None
+        """
+        self.mean = np.asarray(mean, dtype=np.float64)
+        self.scale = np.asarray(scale, dtype=np.float64)
+        self.weights = np.asarray(weights, dtype=np.float64)
+        self.bias = float(bias)
+
+    @classmethod
+    def fit(cls, features, labels, l2=1e-3, iterations=50, tolerance=1e-8):
+        """
+        Fit the classifier with Newton's method on the L2-regularized log loss.
+
+        Parameters:
+        - features (numpy.ndarray): Array of shape (N, 4) with the torso features.
+        - labels (numpy.ndarray): Label of each row, 0 or 1.
+        - l2 (float): Strength of the L2 regularization of the weights.
+        - iterations (int): Maximum number of Newton steps.
+        - tolerance (float): Largest parameter change at which the fit is considered converged.
+
+        Returns:
+        - PostureClassifier: Fitted classifier.
+        """
+        features = np.asarray(features, dtype=np.float64)
+        labels = np.asarray(labels, dtype=np.float64)
+
+        mean = np.nanmean(features, axis=0)
+        scale = np.nanstd(features, axis=0)
+        scale[~(scale > 0)] = 1.0
+        classifier = cls(mean, scale, np.zeros(features.shape[1]), 0.0)
+
+        # The intercept is the last column and is not regularized
+        x = np.column_stack([classifier._standardize(features), np.ones(len(features))])
+        penalty = np.full(x.shape[1], l2)
+        penalty[-1] = 0.0
+        parameters = np.zeros(x.shape[1])
+
+        for _ in range(iterations):
+            p = sigmoid(x @ parameters)
+            gradient = x.T @ (p - labels) / len(x) + penalty * parameters
+            hessian = (x.T * (p * (1 - p))) @ x / len(x) + np.diag(penalty)
+            step = np.linalg.lstsq(hessian, gradient, rcond=None)[0]
+            parameters -= step
+            if np.abs(step).max() < tolerance:
+                break
+
+        classifier.weights, classifier.bias = parameters[:-1], float(parameters[-1])
+        return classifier
+
+    def _standardize(self, features):
+        standardized = (features - self.mean) / self.scale
+        # Missing features are set to the training mean
+        return np.nan_to_num(standardized, nan=0.0)
+
+    def predict_proba(self, features):
+        """
+        Predict label probabilities from torso features.
+
+        Parameters:
+        - features (numpy.ndarray): Array of shape (N, 4) with the torso features.
+
+        Returns:
+        - numpy.ndarray: Array of shape (N, 2) with the probabilities of label 0 and label 1.
+        """
+        p = sigmoid(self._standardize(np.asarray(features, dtype=np.float64)) @ self.weights + self.bias)
+        return np.column_stack([1 - p, p])
+
+    def score(self, keypoints):
+        """
+        Predict label probabilities straight from PoseNet keypoints.
+
+        Parameters:
+        - keypoints (numpy.ndarray): Array of shape (..., 17, 3) with 'y', 'x' and 'confidence' values.
+
+        Returns:
+        - numpy.ndarray: Array of shape (..., 2) with the probabilities of label 0 and label 1 for each pose.
+        """
+        keypoints = np.asarray(keypoints)
+        features = feature_matrix(calculate_features(keypoints.reshape(-1, 17, 3)))
+        return self.predict_proba(features).reshape(*keypoints.shape[:-2], 2)
+
+    def predict(self, keypoints):
+        """
+        Predict the label of each pose from PoseNet keypoints.
+
+        Parameters:
+        - keypoints (numpy.ndarray): Array of shape (..., 17, 3) with 'y', 'x' and 'confidence' values.
+
+        Returns:
+        - numpy.ndarray: Array of shape (...) with the predicted label of each pose.
+        """
+        return self.score(keypoints).argmax(axis=-1)
+
+    def save(self, path):
+        """
+        Save the classifier parameters to a .npz file.
+
+        Parameters:
+        - path (str): Path to the .npz file.
+
+        Returns:
+        - None
+        """
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        np.savez(path, mean=self.mean, scale=self.scale, weights=self.weights, bias=self.bias, feature_names=FEATURE_NAMES)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a classifier saved with save.
+
+        Parameters:
+        - path (str): Path to the .npz file.
+
+        Returns:
+        - PostureClassifier: Loaded classifier.
+        """
+        with np.load(path) as data:
+            if list(data['feature_names']) != FEATURE_NAMES:
+                raise ValueError(f"{path} was trained on different features: {list(data['feature_names'])}")
+            return cls(data['mean'], data['scale'], data['weights'], data['bias'])
+
+def train_classifier(dataset_path, model_path, test_size=0.2, seed=0, l2=1e-3):
+    """
+    Train a PostureClassifier on the dataset CSV file, report its accuracy on a held-out split and save it.
+
+    Parameters:
+    - dataset_path (str): Path to the dataset CSV file generated by generate_datasset.
+    - model_path (str): Path to save the classifier to (.npz).
+    - test_size (float): Fraction of the rows held out for evaluation.
+    - seed (int): Seed of the train/test split.
+    - l2 (float): Strength of the L2 regularization of the weights.
+
+    Returns:
+    - dict: Number of training and test rows and the train and test accuracy.
+    """
+    df = pd.read_csv(dataset_path)
+    features = feature_matrix(df)
+    labels = df['Target'].to_numpy()
+
+    order = np.random.default_rng(seed).permutation(len(df))
+    test_count = int(len(df) * test_size)
+    test, train = order[:test_count], order[test_count:]
+
+    classifier = PostureClassifier.fit(features[train], labels[train], l2)
+    metrics = {
+        'train_rows': len(train),
+        'test_rows': len(test),
+        'train_accuracy': float((classifier.predict_proba(features[train]).argmax(axis=1) == labels[train]).mean()),
+        'test_accuracy': float((classifier.predict_proba(features[test]).argmax(axis=1) == labels[test]).mean()) if len(test) else None,
+    }
+
+    # The saved classifier is refitted on all rows
+    PostureClassifier.fit(features, labels, l2).save(model_path)
+    print(f"Classifier saved to {model_path}, accuracy on {len(train)} training and {len(test)} test rows: "
+          f"{metrics['train_accuracy']:.3f} / {metrics['test_accuracy'] if metrics['test_accuracy'] is None else round(metrics['test_accuracy'], 3)}")
+    return metrics
@@ -1,86 +1,383 @@
 import os
 import cv2
+import functools
+import multiprocessing
 import numpy as np
-import pandas as pd
 from tqdm import tqdm
 
-from scripts.posenet import PoseNetDetector, process_output, draw_poses
+from scripts.augmenter import augment_image, augmented_name
+from scripts.posenet import PoseNetDetector, draw_poses
+from scripts.keypointstore import merge_parts, export_csv
+from scripts.checkpoint import StageManifest, KeypointPartWriter
+from scripts.inferencecache import InferenceCache
+from scripts.pipeline import StageTimer, run_pipeline
+from scripts.shard import in_shard
+from scripts import profiler
 
-def detect_and_save_poses(input_folder_0, input_folder_1, output_folder, model_path, csv_path):
+# PoseNet detector of the current process and the arguments to create it with, set by init_detector
+_detector = None
+_detector_args = None
+
+def init_detector(model_path, num_threads=None, profile=(False, False)):
+    """
+    Set up the PoseNet detector used by detect_batch in the current process.
+
+    The detector is created on first use, so runs served entirely from the cache never load the model.
+
+    Parameters:
+    - model_path (str): Path to the TensorFlow Lite model file.
+    - num_threads (int, optional): Number of threads used by the TensorFlow Lite interpreter.
+    - profile (tuple): Profiling settings of the parent process, as returned by profiler.options.
+
+    Returns:
+    - None
+    """
+    global _detector, _detector_args
+    profiler.configure(*profile)
+    _detector = None
+    _detector_args = (model_path, num_threads)
+
+def get_detector():
+    """
+    Get the PoseNet detector of the current process, creating it if needed.
+
+    Returns:
+    - PoseNetDetector: Detector set up by init_detector.
+    """
+    global _detector
+    if _detector is None:
+        _detector = PoseNetDetector(*_detector_args)
+    return _detector
+
+def augmentation_params(augment_count, seed, i):
+    """
+    Describe the augmentation an image was processed with, as part of its cache key.
+
+    Parameters:
+    - augment_count (int): Number of augmented copies created for the original image.
+    - seed (int, optional): Seed the copies were created with.
+    - i (int): Index of the augmented copy.
+
+    Returns:
+    - str: Augmentation parameters, empty if the images are not augmented.
+    """
+    if not augment_count:
+        return ''
+    return f"augment_count={augment_count};seed={seed};copy={i}"
+
+def outputs_exist(label, names, options):
+    """
+    Check whether the images a run would save for an input image are already on disk.
+
+    Parameters:
+    - label (int): Class label of the image.
+    - names (list): File names of the images detected for the input image.
+    - options (dict): Options of the run.
+
+    Returns:
+    - bool: True if all requested pose-detected and augmented images exist.
+    """
+    folders = []
+    if options['save_annotated']:
+        folders.append(options['output_folder'])
+    if options['augment_count'] and options['output_folder_augmented'] is not None:
+        folders.append(options['output_folder_augmented'])
+    return all(os.path.exists(os.path.join(f"{folder}/{label}", name)) for folder in folders for name in names)
+
+def read_batch(task):
+    """
+    Read the images of a batch, or create their augmented copies in memory if augmentation is enabled.
+
+    With a cache, images whose keypoints are cached and whose output images exist are not decoded.
+    Augmented copies on disk with a known original image are cached by the original image, and are
+    not even read when cached.
+
+    Parameters:
+    - task (tuple): Label, input folder, file names of the batch and the options of the run.
+
+    Returns:
+    - list: Entries with the file name, image, cached keypoints and cache key of each image to detect poses on.
+    """
+    label, input_folder, filenames, options = task
+    cache = options['cache']
+
+    entries = []
+    for filename in filenames:
+        image_path = os.path.join(input_folder, filename)
+        if options['augment_count']:
+            names = [augmented_name(filename, i) for i in range(options['augment_count'])]
+        else:
+            names = [filename]
+
+        if cache is None:
+            keys = [None] * len(names)
+            with profiler.timer('imread'):
+                image = cv2.imread(image_path)
+        else:
+            data = None
+            if filename in options['sources']:
+                # Key the copy by the original image it was created from, as in-memory augmentation does
+                digest, augment_count, seed, i = options['sources'][filename]
+                keys = [cache.digest_key(digest, augmentation_params(augment_count, seed, i))]
+            else:
+                with open(image_path, 'rb') as file:
+                    data = file.read()
+                keys = [cache.key(data, augmentation_params(options['augment_count'], options['seed'], i)) for i in range(len(names))]
+
+            # Skip images that were already processed
+            if outputs_exist(label, names, options):
+                with profiler.timer('cache.get'):
+                    cached = [cache.get(key) for key in keys]
+                if all(keypoints is not None for keypoints in cached):
+                    profiler.count('cache.hits', len(names))
+                    entries += [{'name': name, 'image': None, 'keypoints': keypoints, 'key': None}
+                                for name, keypoints in zip(names, cached)]
+                    continue
+            profiler.count('cache.misses', len(names))
+
+            if data is None:
+                with open(image_path, 'rb') as file:
+                    data = file.read()
+            with profiler.timer('imread'):
+                image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+
+        if options['augment_count']:
+            with profiler.timer('augment'):
+                images = [augmented_image for _, augmented_image in augment_image(image, filename, options['augment_count'], options['seed'])]
+
+            # Save the augmented images if requested
+            if options['output_folder_augmented'] is not None:
+                for name, augmented_image in zip(names, images):
+                    with profiler.timer('imwrite'):
+                        cv2.imwrite(os.path.join(f"{options['output_folder_augmented']}/{label}", name), augmented_image)
+        else:
+            images = [image]
+
+        entries += [{'name': name, 'image': image, 'keypoints': None, 'key': key}
+                    for name, image, key in zip(names, images, keys)]
+    return entries
+
+def infer_batch(task, entries):
+    """
+    Detect poses in the images of a batch that are not cached.
+
+    Parameters:
+    - task (tuple): Label, input folder, file names of the batch and the options of the run.
+    - entries (list): Entries of the images of the batch.
+
+    Returns:
+    - list: Entries with the keypoint arrays of shape (P, 17, 3) of the detected poses filled in.
+    """
+    pending = [entry for entry in entries if entry['keypoints'] is None]
+    if pending:
+        batch_keypoints = get_detector().detect_batch([entry['image'] for entry in pending])
+        for entry, keypoints in zip(pending, batch_keypoints):
+            entry['keypoints'] = keypoints
+    return entries
+
+def write_batch(task, _, entries):
+    """
+    Cache the keypoints of a batch, and draw the detected poses and save the pose-detected images if requested.
+
+    Parameters:
+    - task (tuple): Label, input folder, file names of the batch and the options of the run.
+    - entries (list): Entries of the images of the batch with their keypoints, as returned by infer_batch.
+
+    Returns:
+    - tuple: Label, file names and the keypoint arrays of shape (P, 17, 3) detected on each image.
     """
-    Detect and save poses from images in the input folders and store the keypoints and labels in a CSV file.
+    label, input_folder, filenames, options = task
+
+    for entry in entries:
+        if entry['image'] is None:
+            continue
+
+        # Store the keypoints of newly processed images in the cache
+        if entry['key'] is not None:
+            with profiler.timer('cache.put'):
+                options['cache'].put(entry['key'], entry['keypoints'])
+
+        # Draw detected poses on the image and save it
+        if options['save_annotated']:
+            draw_poses(entry['image'], entry['keypoints'])
+            with profiler.timer('imwrite'):
+                cv2.imwrite(os.path.join(f"{options['output_folder']}/{label}", entry['name']), entry['image'])
+
+    return label, [entry['name'] for entry in entries], [entry['keypoints'] for entry in entries]
+
+def detect_batch(task):
+    """
+    Detect poses in a batch of images, draw them and save the pose-detected images.
+
+    Parameters:
+    - task (tuple): Label, input folder, file names of the batch and the options of the run.
+
+    Returns:
+    - tuple: Label, file names and the keypoint arrays of shape (P, 17, 3) detected on each image.
+    """
+    entries = read_batch(task)
+    return write_batch(task, entries, infer_batch(task, entries))
+
+def detect_and_save_poses(input_folder_0, input_folder_1, output_folder, model_path, keypoints_path, csv_path=None, num_threads=None, batch_size=8, workers=1, readers=2, writers=2, queue_size=8,
+                          augment_count=0, output_folder_augmented=None, save_annotated=True, seed=None,
+                          cache_dir=None, cache_size=1 << 30, checkpoint_dir=None, resume=False, chunk_size=10000, shard=None, sources=None):
+    """
+    Detect and save poses from images in the input folders and store the keypoints and labels in a keypoint store.
+
+    Images are processed in order of class and file name. With a single worker, reading and
+    decoding, inference, and drawing and encoding run as overlapping stages connected by bounded
+    queues, and the time spent in each stage is printed at the end. With several workers the
+    batches are shared out to a process pool, each process running its own PoseNetDetector, and
+    the results are merged back in the same order, so the keypoint store matches a run with a
+    single worker.
+
+    If augment_count is set, the input folders hold the original images and their augmented copies
+    are created in memory and passed straight to the detector, without writing them to disk
+    unless output_folder_augmented is given.
+
+    With a cache folder, keypoints are cached by image content, model file and augmentation
+    parameters, and images processed by an earlier run are skipped. In-memory augmentation is
+    only cached with a seed, since unseeded augmented copies differ from run to run. Augmented
+    copies listed in sources are cached by the original image they were created from, so they
+    share the cache entries of the same copies created in memory.
+
+    Keypoints are appended to part files of chunk_size rows in the checkpoint folder as they are
+    detected, and the input files of every written part are recorded in the detect manifest, so
+    memory use does not grow with the number of images. With resume, files recorded by an earlier
+    run are skipped, and the parts are merged into the keypoint store at the end.
 
     Parameters:
     - input_folder_0 (str): Path to the first input folder containing images of the first class.
     - input_folder_1 (str): Path to the second input folder containing images of the second class.
     - output_folder (str): Path to the output folder where the pose-detected images will be saved.
     - model_path (str): Path to the TensorFlow Lite model file.
-    - csv_path (str): Path to the CSV file where keypoints and labels will be saved.
+    - keypoints_path (str): Path to the keypoint store (.npy) where keypoints and labels will be saved.
+      Older versions took the path of the keypoints CSV file in this place, so any other extension is refused.
+    - csv_path (str, optional): Path to additionally export the keypoints in the legacy CSV format.
+    - num_threads (int, optional): Number of threads used by the TensorFlow Lite interpreter of each worker.
+    - batch_size (int): Number of images passed to the detector per inference.
+    - workers (int): Number of processes running pose detection.
+    - readers (int): Number of threads reading images in single worker mode.
+    - writers (int): Number of threads saving pose-detected images in single worker mode.
+    - queue_size (int): Maximum number of batches waiting between two stages in single worker mode.
+    - augment_count (int): Number of augmented copies to create in memory for each image, 0 to detect poses on the images themselves.
+    - output_folder_augmented (str, optional): Path to the folder where the in-memory augmented images will be saved.
+    - save_annotated (bool): Whether to save the pose-detected images.
+    - seed (int, optional): Seed for reproducible in-memory augmentation.
+    - cache_dir (str, optional): Folder of the inference cache, None to detect poses on every image.
+    - cache_size (int): Maximum size of the inference cache in bytes.
+    - checkpoint_dir (str, optional): Folder of the detect manifest and keypoint parts, next to the keypoint store by default.
+    - resume (bool): Whether to continue from the checkpoints of an earlier run.
+    - chunk_size (int): Number of keypoint rows per part file.
+    - shard (tuple, optional): Index and number of shards, to detect poses only on the images of one shard.
+    - sources (dict, optional): Original images of augmented copies in the input folders, by path of the copy, as returned by augmented_sources.
 
     Returns:
     - None
     """
+    if not keypoints_path.endswith('.npy'):
+        raise ValueError(f"keypoints_path must be a .npy keypoint store, got {keypoints_path}; pass csv_path to also export the legacy CSV file")
+
+    # Create the output folders if they do not exist
+    for folder in (output_folder if save_annotated else None, output_folder_augmented):
+        if folder is not None:
+            for label in range(2):
+                os.makedirs(f"{folder}/{label}", exist_ok=True)
+
+    # Set up the inference cache
+    cache = None
+    if cache_dir is not None and (not augment_count or seed is not None):
+        cache = InferenceCache(cache_dir, model_path, cache_size)
+
+    options = {
+        'output_folder': output_folder,
+        'save_annotated': save_annotated,
+        'augment_count': augment_count,
+        'output_folder_augmented': output_folder_augmented,
+        'seed': seed,
+        'cache': cache,
+        'sources': {},
+    }
+
+    # Set up the checkpoints the keypoints data, labels and source image names are appended to
+    if checkpoint_dir is None:
+        checkpoint_dir = f"{os.path.splitext(keypoints_path)[0]}_checkpoint"
+    manifest = StageManifest(os.path.join(checkpoint_dir, 'detect.jsonl'), resume)
+    writer = KeypointPartWriter(os.path.join(checkpoint_dir, 'parts'), manifest, chunk_size)
+
+    # Split the images of both classes into batches, ordered by class and file name,
+    # with augmentation each image turns into augment_count images for the detector
+    images_per_file = max(augment_count, 1)
+    files_per_batch = max(batch_size // images_per_file, 1)
+    tasks = []
+    for label, input_folder in enumerate((input_folder_0, input_folder_1)):
+        filenames = sorted(filename for filename in os.listdir(input_folder)
+                           if (filename.endswith(".jpg") or filename.endswith(".png")) and in_shard(filename, shard))
+        filenames = [filename for filename in filenames if f"{label}/{filename}" not in manifest.completed]
+        for start in range(0, len(filenames), files_per_batch):
+            batch = filenames[start:start + files_per_batch]
+            batch_options = options
+            if cache is not None and sources:
+                # Every task only carries the original images of its own files
+                batch_sources = {filename: sources[os.path.join(input_folder, filename)] for filename in batch
+                                 if os.path.join(input_folder, filename) in sources}
+                batch_options = dict(options, sources=batch_sources)
+            tasks.append((label, input_folder, batch, batch_options))
+
+    with tqdm(total=sum(len(task[2]) for task in tasks) * images_per_file) as progress:
+        if workers > 1:
+            # Each worker process sets up its own PoseNet detector, imap keeps the results in task order
+            pool = multiprocessing.get_context('spawn').Pool(workers, initializer=init_detector, initargs=(model_path, num_threads, profiler.options()))
+            if profiler.enabled():
+                # Workers send back what they recorded along with every result
+                results = profiler.merge_results(pool.imap(functools.partial(profiler.collecting, detect_batch), tasks))
+            else:
+                results = pool.imap(detect_batch, tasks)
+        else:
+            # Overlap reading, inference and writing within this process
+            pool = None
+            timer = StageTimer()
+            init_detector(model_path, num_threads)
+            results = run_pipeline(tasks, read_batch, infer_batch, write_batch, readers, writers, queue_size, timer)
+
+        try:
+            for task, (label, filenames, batch_keypoints) in zip(tasks, results):
+                # Process and save keypoints data and labels
+                counts = [len(keypoints) for keypoints in batch_keypoints]
+                keypoints_data = np.concatenate(batch_keypoints).reshape(-1, 17, 3)
+                labels = [label] * len(keypoints_data)
+                sources = list(np.repeat(filenames, counts))
+                writer.add([f"{label}/{filename}" for filename in task[2]], keypoints_data, labels, sources)
+
+                progress.update(len(filenames))
+        except BaseException:
+            # Stop the queued tasks, instead of waiting for all of them before the error comes out
+            if pool is not None:
+                pool.terminate()
+            raise
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+            # Also after an error, so a resumed run does not detect the finished batches again
+            writer.flush()
+
+    if pool is None:
+        print(timer.report())
+
+    # Keep the cache within its size limit
+    if cache is not None:
+        cache.evict()
+
+    # Merge the parts into the keypoint store
+    with profiler.timer('merge_parts'):
+        records = merge_parts(writer.parts(), keypoints_path)
 
-    # Create the output folder if it does not exist
-    if not os.path.exists(output_folder):
-        os.makedirs(output_folder)
-
-    # Lists to store keypoints data and labels
-    all_keypoints_data = []
-    all_labels = []
-
-    # Initialize PoseNet detector
-    posenet_detector = PoseNetDetector(model_path)
-
-    # Process images in the first input folder
-    for filename in tqdm(os.listdir(input_folder_0)):
-        if filename.endswith(".jpg") or filename.endswith(".png"):
-            image_path = os.path.join(input_folder_0, filename)
-            image = cv2.imread(image_path)
-
-            # Detect poses in the image
-            poses = posenet_detector.process_image(image)
-
-            # Process and save keypoints data and labels
-            for pose_data in poses:
-                keypoints = process_output(pose_data)
-                all_keypoints_data.append(keypoints)
-                all_labels.append(0)
-            
-            # Draw detected poses on the image and save it
-            draw_poses(image, poses)
-            cv2.imwrite(os.path.join(f"{output_folder}/0", filename), image)
-
-    # Process images in the second input folder
-    for filename in tqdm(os.listdir(input_folder_1)):
-        if filename.endswith(".jpg") or filename.endswith(".png"):
-            image_path = os.path.join(input_folder_1, filename)
-            image = cv2.imread(image_path)
-
-            # Detect poses in the image
-            poses = posenet_detector.process_image(image)
-
-            # Process and save keypoints data and labels
-            for pose_data in poses:
-                keypoints = process_output(pose_data)
-                all_keypoints_data.append(keypoints)
-                all_labels.append(1)
-            
-            # Draw detected poses on the image and save it
-            draw_poses(image, poses)
-            cv2.imwrite(os.path.join(f"{output_folder}/1", filename), image)
-
-    # Create a DataFrame to store keypoints data and labels
-    df = pd.DataFrame(all_keypoints_data, columns=[
-        'Nose', 'Left Eye', 'Right Eye', 'Left Ear', 'Right Ear',
-        'Left Shoulder', 'Right Shoulder', 'Left Elbow', 'Right Elbow',
-        'Left Wrist', 'Right Wrist', 'Left Hip', 'Right Hip',
-        'Left Knee', 'Right Knee', 'Left Ankle', 'Right Ankle'])
-
-    df['Label'] = all_labels
-
-    # Save the DataFrame to a CSV file
-    df.to_csv(csv_path, index=False)
+    # Export the keypoints to the legacy CSV format if requested
+    if csv_path is not None:
+        with profiler.timer('export_csv'):
+            export_csv(records, csv_path)
 
 if __name__ == "__main__":
     # Input and output paths
@@ -88,7 +385,7 @@ if __name__ == "__main__":
     input_folder_1 = 'augmented_images_1'
     output_folder = 'pose_detected_images'
     model_path = '4.tflite'
-    csv_path = 'keypoints_data.csv'
+    keypoints_path = 'keypoints_data.npy'
 
     # Call the main function
-    detect_and_save_poses(input_folder_0, input_folder_1, output_folder, model_path, csv_path)
+    detect_and_save_poses(input_folder_0, input_folder_1, output_folder, model_path, keypoints_path)
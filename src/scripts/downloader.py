@@ -1,12 +1,81 @@
 from googleapiclient.discovery import build
 from google.oauth2 import service_account
+from googleapiclient.errors import HttpError
 from googleapiclient.http import MediaIoBaseDownload
 
 import os
+import time
+import random
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from tqdm import tqdm
+
+from scripts.checkpoint import StageManifest
+
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+
+# HTTP statuses of rate limiting and transient server errors, worth retrying
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Smaller than the 100 MB default of MediaIoBaseDownload, so a failed chunk costs less to retry
+DEFAULT_CHUNK_SIZE = 16 * 1024 * 1024
+
+def md5_checksum(path):
+    """
+    Calculate the MD5 checksum of a file, as reported by Drive in md5Checksum.
+
+    Parameters:
+    - path (str): Path to the file.
+
+    Returns:
+    - str: Hex digest of the file content.
+    """
+    digest = hashlib.md5()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def download_media(request, file, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Download the content of a get_media request into a file chunk by chunk.
+
+    Parameters:
+    - request (googleapiclient.http.HttpRequest): Request returned by files().get_media.
+    - file (file): File opened for binary writing.
+    - chunk_size (int): Number of bytes requested per chunk.
+
+    Yields:
+    - float: Downloaded fraction of the file after every chunk.
+    """
+    downloader = MediaIoBaseDownload(file, request, chunksize=chunk_size)
+    done = False
+    while not done:
+        status, done = downloader.next_chunk()
+        yield status.progress()
 
 class GoogleDriveDownloader:
-    def __init__(self):
-        self.service = self._authenticate()
+    def __init__(self, service_factory=None, retries=5, backoff=1.0, download_media=download_media):
+        """
+        Initialize the GoogleDriveDownloader.
+
+        Parameters:
+        - service_factory (callable, optional): Function building a Drive v3 service, called once per download thread.
+          Authenticates with the service account by default, a thread-safe local fake can return the same object every time.
+        - retries (int): Number of times a failed request is retried.
+        - backoff (float): Delay before the first retry in seconds, doubled on every further retry.
+        - download_media (callable): Function downloading the content of a get_media request into a file, as download_media.
+
+        Returns:
+        - None
+        """
+        self.service_factory = service_factory if service_factory is not None else self._authenticate
+        self.service = self.service_factory()
+        self.retries = retries
+        self.backoff = backoff
+        self.download_media = download_media
+        self._local = threading.local()
 
     def _authenticate(self):
         SCOPES = ['https://www.googleapis.com/auth/drive']
@@ -14,31 +83,161 @@ class GoogleDriveDownloader:
         credentials = service_account.Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE, scopes=SCOPES)
         return build('drive', 'v3', credentials=credentials)
 
-    def download_folder_contents(self, folder_id, destination_path):
-        results = self.service.files().list(q=f"'{folder_id}' in parents", fields="files(id, name, mimeType)").execute()
-        items = results.get('files', [])
+    def _get_service(self):
+        # Services are not thread-safe, so every download thread builds its own
+        if threading.current_thread() is threading.main_thread():
+            return self.service
+        if getattr(self._local, 'service', None) is None:
+            self._local.service = self.service_factory()
+        return self._local.service
+
+    def _retry(self, function, *args, **kwargs):
+        """
+        Call a function, retrying transient errors with exponential backoff and jitter.
+
+        Parameters:
+        - function (callable): Function to call.
+        - args, kwargs: Arguments of the call.
+
+        Returns:
+        - Result of the call.
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                return function(*args, **kwargs)
+            except (HttpError, OSError) as error:
+                if isinstance(error, HttpError) and error.resp.status not in RETRY_STATUSES:
+                    raise
+                if attempt == self.retries:
+                    raise
+                time.sleep(self.backoff * 2 ** attempt * (1 + random.random()))
+
+    def list_folder(self, folder_id):
+        """
+        List the contents of a folder, following nextPageToken through all pages of the listing.
 
-        for item in items:
-            file_id = item['id']
-            file_name = item['name']
-            file_type = item['mimeType']
+        Parameters:
+        - folder_id (str): Drive ID of the folder.
 
-            if file_type == 'application/vnd.google-apps.folder':
-                subfolder_path = os.path.join(destination_path, file_name)
-                os.makedirs(subfolder_path, exist_ok=True)
-                self.download_folder_contents(file_id, subfolder_path)
+        Returns:
+        - list: Files and folders with their 'id', 'name', 'mimeType', 'size' and 'md5Checksum'.
+        """
+        items = []
+        page_token = None
+        while True:
+            results = self._retry(lambda: self._get_service().files().list(
+                q=f"'{folder_id}' in parents and trashed = false",
+                fields="nextPageToken, files(id, name, mimeType, size, md5Checksum)",
+                pageSize=1000,
+                pageToken=page_token).execute())
+            items += results.get('files', [])
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                return items
+
+    def walk(self, folder_id, destination_path):
+        """
+        Recursively list the files of a folder and create the matching local folders.
+
+        Parameters:
+        - folder_id (str): Drive ID of the folder.
+        - destination_path (str): Local folder mirroring the Drive folder.
+
+        Yields:
+        - tuple: Drive file and the local path it is downloaded to.
+        """
+        os.makedirs(destination_path, exist_ok=True)
+        for item in self.list_folder(folder_id):
+            file_path = os.path.join(destination_path, item['name'])
+            if item['mimeType'] == FOLDER_MIME_TYPE:
+                yield from self.walk(item['id'], file_path)
+            else:
+                yield item, file_path
+
+    def download_file(self, item, file_path, chunk_size=DEFAULT_CHUNK_SIZE, progress=False):
+        """
+        Download a file, replacing the local copy only once it is complete and matches the Drive checksum.
+
+        Parameters:
+        - item (dict): Drive file with its 'id', 'name' and optionally 'md5Checksum'.
+        - file_path (str): Local path to save the file to.
+        - chunk_size (int): Number of bytes requested per chunk.
+        - progress (bool): Whether to print the progress of every chunk.
+
+        Returns:
+        - None
+        """
+        temporary_path = f"{file_path}.part"
+        with open(temporary_path, 'wb') as file:
+            request = self._get_service().files().get_media(fileId=item['id'])
+            for fraction in self.download_media(request, file, chunk_size):
+                if progress:
+                    print(f"Downloaded {int(fraction * 100)}% of {item['name']}")
+
+        if item.get('md5Checksum') and md5_checksum(temporary_path) != item['md5Checksum']:
+            os.remove(temporary_path)
+            raise OSError(f"Checksum mismatch for {item['name']}")
+        os.replace(temporary_path, file_path)
+
+    def download_folder_contents(self, folder_id, destination_path, chunk_size=DEFAULT_CHUNK_SIZE):
+        for item, file_path in self.walk(folder_id, destination_path):
+            self._retry(self.download_file, item, file_path, chunk_size, progress=True)
+
+    def sync_folder(self, folder_id, destination_path, workers=4, chunk_size=DEFAULT_CHUNK_SIZE, manifest_path=None):
+        """
+        Mirror a Drive folder into a local folder, downloading only new and changed files.
+
+        Downloaded files are recorded in a manifest with their Drive size and md5Checksum, and
+        files that still match their manifest entry and exist locally are skipped, so an interrupted
+        sync resumes where it stopped. Downloads run in a bounded pool of threads.
+
+        Parameters:
+        - folder_id (str): Drive ID of the folder.
+        - destination_path (str): Local folder mirroring the Drive folder.
+        - workers (int): Number of concurrent downloads.
+        - chunk_size (int): Number of bytes requested per chunk.
+        - manifest_path (str, optional): Path to the manifest, next to the destination folder by default.
+
+        Returns:
+        - dict: Number of downloaded and skipped files.
+        """
+        if manifest_path is None:
+            manifest_path = f"{os.path.normpath(destination_path)}.manifest.jsonl"
+        manifest = StageManifest(manifest_path, resume=True)
+        synced = {entry['items'][0]: entry for entry in manifest.entries}
+
+        pending = []
+        skipped = 0
+        for item, file_path in self.walk(folder_id, destination_path):
+            relative_path = os.path.relpath(file_path, destination_path).replace(os.sep, '/')
+            entry = synced.get(relative_path)
+            if (entry is not None and entry['id'] == item['id']
+                    and entry['size'] == item.get('size') and entry['md5Checksum'] == item.get('md5Checksum')
+                    and os.path.exists(file_path)
+                    and (item.get('size') is None or os.path.getsize(file_path) == int(item['size']))):
+                skipped += 1
             else:
-                request = self.service.files().get_media(fileId=file_id)
-                file_path = os.path.join(destination_path, file_name)
-                with open(file_path, 'wb') as file:
-                    downloader = MediaIoBaseDownload(file, request)
-                    done = False
-                    while not done:
-                        status, done = downloader.next_chunk()
-                        print(f"Downloaded {int(status.progress() * 100)}% of {file_name}")
+                pending.append((item, file_path, relative_path))
+
+        errors = []
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(self._retry, self.download_file, item, file_path, chunk_size): (item, relative_path)
+                       for item, file_path, relative_path in pending}
+            for future in tqdm(as_completed(futures), total=len(futures), desc="Downloading files"):
+                item, relative_path = futures[future]
+                try:
+                    future.result()
+                except Exception as error:
+                    errors.append(error)
+                    continue
+                manifest.mark([relative_path], id=item['id'], size=item.get('size'), md5Checksum=item.get('md5Checksum'))
+
+        if errors:
+            raise errors[0]
+        return {'downloaded': len(pending), 'skipped': skipped}
 
 if __name__ == "__main__":
     downloader = GoogleDriveDownloader()
     folder_id = '1wDkSNTEAZf0DJwRaXlQAmMIj4JIEmNYS' 
     destination_path = 'downloaded_files' 
-    downloader.download_folder_contents(folder_id, destination_path)
\ No newline at end of file
+    downloader.sync_folder(folder_id, destination_path)
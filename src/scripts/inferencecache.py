@@ -0,0 +1,144 @@
+import os
+import hashlib
+import threading
+import numpy as np
+
+def file_hash(path):
+    """
+    Calculate the SHA-256 hash of a file.
+
+    Parameters:
+    - path (str): Path to the file.
+
+    Returns:
+    - str: Hex digest of the file content.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class InferenceCache:
+    """
+    Class for caching detected keypoints on disk, keyed by image content, model and augmentation parameters.
+
+    Every entry is a .npy file with the keypoints of one image. Entries are touched when they
+    are read, and evict removes the least recently used ones once the cache grows over its size limit.
+
+    Attributes:
+    - cache_dir (str): Folder the entries are stored in.
+    - model_hash (str): Hash of the model file the keypoints were detected with.
+    - max_size (int): Maximum total size of the entries in bytes.
+    """
+
+    def __init__(self, cache_dir, model_path, max_size=1 << 30):
+        """
+        Initialize the InferenceCache for the given model.
+
+        Parameters:
+        - cache_dir (str): Folder the entries are stored in.
+        - model_path (str): Path to the TensorFlow Lite model file.
+        - max_size (int): Maximum total size of the entries in bytes.
+
+        Returns:
+        - None
+        """
+        self.cache_dir = cache_dir
+        self.model_hash = file_hash(model_path)
+        self.max_size = max_size
+
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+    def key(self, data, params=''):
+        """
+        Build the cache key of an image.
+
+        Parameters:
+        - data (bytes): Encoded content of the image file.
+        - params (str): Augmentation parameters the image was processed with.
+
+        Returns:
+        - str: Hex digest identifying the image, the model and the parameters.
+        """
+        return self.digest_key(hashlib.sha256(data).hexdigest(), params)
+
+    def digest_key(self, digest, params=''):
+        """
+        Build the cache key of an image from the SHA-256 hash of its content, as returned by file_hash.
+
+        Parameters:
+        - digest (str): Hex digest of the content of the image file.
+        - params (str): Augmentation parameters the image was processed with.
+
+        Returns:
+        - str: Hex digest identifying the image, the model and the parameters.
+        """
+        return hashlib.sha256(f"{self.model_hash}:{params}:{digest}".encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.npy")
+
+    def get(self, key):
+        """
+        Get the cached keypoints of an image.
+
+        Parameters:
+        - key (str): Cache key of the image.
+
+        Returns:
+        - numpy.ndarray: Keypoint array of shape (P, 17, 3) of the detected poses, or None if the image is not cached.
+        """
+        path = self._path(key)
+        try:
+            keypoints = np.load(path)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return keypoints
+
+    def put(self, key, keypoints):
+        """
+        Store the keypoints of an image.
+
+        Parameters:
+        - key (str): Cache key of the image.
+        - keypoints (numpy.ndarray): Keypoint array of shape (P, 17, 3) of the detected poses.
+
+        Returns:
+        - None
+        """
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write to a temporary file first, so readers never see a partial entry,
+        # named by process and thread, so writer threads storing the same image do not collide
+        temporary_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary_path, 'wb') as file:
+            np.save(file, np.reshape(np.asarray(keypoints, dtype=np.float32), (-1, 17, 3)))
+        os.replace(temporary_path, path)
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache fits its size limit.
+
+        Returns:
+        - int: Number of removed entries.
+        """
+        entries = []
+        for root, _, filenames in os.walk(self.cache_dir):
+            for filename in filenames:
+                if filename.endswith('.npy'):
+                    stat = os.stat(os.path.join(root, filename))
+                    entries.append((stat.st_mtime, stat.st_size, os.path.join(root, filename)))
+
+        total_size = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            os.remove(path)
+            total_size -= size
+            removed += 1
+        return removed
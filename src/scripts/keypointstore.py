@@ -0,0 +1,230 @@
+import os
+import numpy as np
+from numpy.lib import recfunctions
+
+# Keypoint names in the order of the PoseNet output
+KEYPOINT_NAMES = [
+    'Nose', 'Left Eye', 'Right Eye', 'Left Ear', 'Right Ear',
+    'Left Shoulder', 'Right Shoulder', 'Left Elbow', 'Right Elbow',
+    'Left Wrist', 'Right Wrist', 'Left Hip', 'Right Hip',
+    'Left Knee', 'Right Knee', 'Left Ankle', 'Right Ankle']
+
+# Values stored for every keypoint, in the order of the PoseNet output
+COORDINATES = ('y', 'x', 'confidence')
+
+# Matches a stringified keypoint dict, with or without numpy scalar wrappers around the values
+KEYPOINT_PATTERN = (r"'y':\s*(?:np\.float\d+\()?([^,()]+)\)?,\s*"
+                    r"'x':\s*(?:np\.float\d+\()?([^,()]+)\)?,\s*"
+                    r"'confidence':\s*(?:np\.float\d+\()?([^,()}]+)\)?")
+
+def keypoint_fields():
+    """
+    Get the names of the keypoint columns of the store.
+
+    Returns:
+    - list: Column names like 'Left Hip x', one per keypoint and coordinate.
+    """
+    return [f"{name} {coordinate}" for name in KEYPOINT_NAMES for coordinate in COORDINATES]
+
+def keypoint_dtype(source_length):
+    """
+    Build the record layout of the keypoint store.
+
+    The keypoint columns come first and are all float32, so on recent NumPy versions the keypoints
+    of a loaded store can be read as an (N, 17, 3) array without copying.
+
+    Parameters:
+    - source_length (int): Maximum length of the source image names.
+
+    Returns:
+    - numpy.dtype: Structured dtype with the keypoint, 'Label' and 'Source' columns.
+    """
+    fields = [(field, np.float32) for field in keypoint_fields()]
+    fields += [('Label', np.int8), ('Source', f"U{max(source_length, 1)}")]
+    return np.dtype(fields)
+
+def to_records(keypoints, labels, sources):
+    """
+    Pack keypoints, labels and source image names into a structured array.
+
+    Parameters:
+    - keypoints (numpy.ndarray): Array of shape (N, 17, 3) with 'y', 'x' and 'confidence' values.
+    - labels (list): Class label of each row.
+    - sources (list): Name of the image each row was detected on.
+
+    Returns:
+    - numpy.ndarray: Structured array with the store layout.
+    """
+    keypoints = np.asarray(keypoints, dtype=np.float32).reshape(-1, len(KEYPOINT_NAMES) * len(COORDINATES))
+    sources = [str(source) for source in sources]
+
+    records = np.zeros(len(keypoints), dtype=keypoint_dtype(max(map(len, sources), default=1)))
+    # Filled field by field, since structured_to_unstructured returns a copy on older NumPy versions
+    for j, field in enumerate(keypoint_fields()):
+        records[field] = keypoints[:, j]
+    records['Label'] = labels
+    records['Source'] = sources
+    return records
+
+def save_keypoints(path, keypoints, labels, sources):
+    """
+    Save keypoints, labels and source image names as a binary keypoint store (.npy).
+
+    Parameters:
+    - path (str): Path to the .npy file.
+    - keypoints (numpy.ndarray): Array of shape (N, 17, 3) with 'y', 'x' and 'confidence' values.
+    - labels (list): Class label of each row.
+    - sources (list): Name of the image each row was detected on.
+
+    Returns:
+    - numpy.ndarray: Saved structured array.
+    """
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+
+    records = to_records(keypoints, labels, sources)
+    np.save(path, records)
+    return records
+
+def load_keypoints(path):
+    """
+    Load a keypoint store.
+
+    .npy stores are memory-mapped, so nothing is read until the columns are accessed.
+    Legacy keypoints.csv files with stringified keypoint dicts are parsed into the same layout.
+
+    Parameters:
+    - path (str): Path to the .npy store or the legacy .csv file.
+
+    Returns:
+    - numpy.ndarray: Structured array with the store layout.
+    """
+    if path.endswith('.csv'):
+        return read_csv(path)
+    return np.load(path, mmap_mode='r')
+
+def merge_parts(part_paths, path):
+    """
+    Concatenate keypoint store parts into a single store, copying one part at a time.
+
+    Parameters:
+    - part_paths (list): Paths to the part files in the order of their rows.
+    - path (str): Path to the merged .npy file.
+
+    Returns:
+    - numpy.ndarray: Merged store, memory-mapped.
+    """
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+
+    parts = [np.load(part_path, mmap_mode='r') for part_path in part_paths]
+    dtype = keypoint_dtype(max((part.dtype['Source'].itemsize // 4 for part in parts), default=1))
+    total = sum(len(part) for part in parts)
+    if not total:
+        np.save(path, np.zeros(0, dtype=dtype))
+        return load_keypoints(path)
+
+    records = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=(total,))
+    offset = 0
+    for part in parts:
+        records[offset:offset + len(part)] = part
+        offset += len(part)
+    records.flush()
+    del records
+
+    return load_keypoints(path)
+
+def keypoint_array(records):
+    """
+    View the keypoint columns of a store as an array.
+
+    Parameters:
+    - records (numpy.ndarray): Structured array with the store layout.
+
+    Returns:
+    - numpy.ndarray: Array of shape (N, 17, 3) with 'y', 'x' and 'confidence' values. Depending on the
+      NumPy version it may share memory with the records, so it should be treated as read-only.
+    """
+    keypoints = recfunctions.structured_to_unstructured(records[keypoint_fields()], copy=False)
+    return keypoints.reshape(len(records), len(KEYPOINT_NAMES), len(COORDINATES))
+
+def iter_keypoints(path, chunk_size=100000):
+    """
+    Read a keypoint store in blocks of rows.
+
+    .npy stores are memory-mapped and sliced, and legacy keypoints.csv files are parsed
+    chunk_size rows at a time, so only one block is held in memory. pandas is only imported for
+    legacy CSV files, so the stages that just read and write .npy stores do not load it.
+
+    Parameters:
+    - path (str): Path to the .npy store or the legacy .csv file.
+    - chunk_size (int): Number of rows per block.
+
+    Yields:
+    - numpy.ndarray: Structured arrays with the store layout, in the order of the rows.
+    """
+    if path.endswith('.csv'):
+        import pandas as pd
+
+        for df in pd.read_csv(path, chunksize=chunk_size):
+            yield frame_to_records(df)
+    else:
+        records = load_keypoints(path)
+        for start in range(0, len(records), chunk_size):
+            yield records[start:start + chunk_size]
+
+def read_csv(csv_path):
+    """
+    Read a legacy keypoints CSV file with stringified keypoint dicts.
+
+    Parameters:
+    - csv_path (str): Path to the CSV file.
+
+    Returns:
+    - numpy.ndarray: Structured array with the store layout.
+    """
+    import pandas as pd
+
+    return frame_to_records(pd.read_csv(csv_path))
+
+def frame_to_records(df):
+    """
+    Parse a DataFrame read from a legacy keypoints CSV file into the store layout.
+
+    Parameters:
+    - df (pandas.DataFrame): DataFrame with one stringified keypoint dict per keypoint column and a 'Label' column.
+
+    Returns:
+    - numpy.ndarray: Structured array with the store layout.
+    """
+    keypoints = np.stack([df[name].astype(str).str.extract(KEYPOINT_PATTERN).to_numpy(dtype=np.float32)
+                          for name in KEYPOINT_NAMES], axis=1)
+    sources = df['Source'] if 'Source' in df else [''] * len(df)
+    return to_records(keypoints, df['Label'].to_numpy(), sources)
+
+def export_csv(records, csv_path, chunk_size=100000):
+    """
+    Export a keypoint store to the legacy CSV format with one stringified dict per keypoint.
+
+    Parameters:
+    - records (numpy.ndarray): Structured array with the store layout.
+    - csv_path (str): Path to the CSV file.
+    - chunk_size (int): Number of rows converted at a time.
+
+    Returns:
+    - None
+    """
+    import pandas as pd
+
+    for start in range(0, max(len(records), 1), chunk_size):
+        chunk = records[start:start + chunk_size]
+
+        df = pd.DataFrame()
+        for name in KEYPOINT_NAMES:
+            y, x, confidence = (pd.Series(chunk[f"{name} {coordinate}"]).astype(str) for coordinate in COORDINATES)
+            df[name] = "{'y': " + y + ", 'x': " + x + ", 'confidence': " + confidence + "}"
+        df['Label'] = chunk['Label']
+
+        df.to_csv(csv_path, index=False, mode='w' if start == 0 else 'a', header=start == 0)
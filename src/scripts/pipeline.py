@@ -0,0 +1,166 @@
+import queue
+import threading
+import time
+
+class StageTimer:
+    """
+    Class for accumulating the time spent in each stage of a pipeline.
+
+    Attributes:
+    - stages (dict): Number of items and total busy time in seconds for each stage.
+    """
+
+    def __init__(self):
+        """
+        Initialize an empty StageTimer.
+
+        Returns:
+        - None
+        """
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds, count=1):
+        """
+        Record the time spent on items of a stage.
+
+        Parameters:
+        - stage (str): Name of the stage.
+        - seconds (float): Time spent on the items.
+        - count (int): Number of items processed.
+
+        Returns:
+        - None
+        """
+        with self._lock:
+            items, total = self.stages.get(stage, (0, 0.0))
+            self.stages[stage] = (items + count, total + seconds)
+
+    def report(self):
+        """
+        Format the number of items, busy time and time per item of each stage.
+
+        Returns:
+        - str: One line per stage.
+        """
+        lines = []
+        for stage, (items, total) in self.stages.items():
+            per_item = total / items * 1000 if items else 0.0
+            lines.append(f"{stage}: {items} items, {total:.2f} s busy, {per_item:.1f} ms/item")
+        return "\n".join(lines)
+
+# Marks the end of the items in a queue
+_DONE = object()
+
+def _worker(function, stage, timer, source, target, errors, inputs=1, outputs=1):
+    """
+    Apply a stage function to the items of a queue until the upstream stage is finished.
+
+    Parameters:
+    - function (callable): Stage function called with the arguments of the item.
+    - stage (str): Name of the stage for the timer.
+    - timer (StageTimer): Timer the busy time is recorded in.
+    - source (queue.Queue): Queue of (sequence number, arguments) pairs.
+    - target (queue.Queue): Queue the (sequence number, result) pairs are put into.
+    - errors (list): List the (sequence number, exception) pairs of failed items are stored in.
+    - inputs (int): Number of end markers to receive before stopping, one per upstream thread.
+    - outputs (int): Number of end markers to send when stopping, one per downstream thread.
+
+    Returns:
+    - None
+    """
+    while inputs:
+        entry = source.get()
+        if entry is _DONE:
+            inputs -= 1
+            continue
+        index, arguments = entry
+        if errors and index > min(failed for failed, _ in errors):
+            # Results after a failed item are never yielded, the item is only drained so
+            # upstream threads blocked on a full queue can finish
+            continue
+
+        start = time.perf_counter()
+        try:
+            result = function(*arguments)
+        except Exception as error:
+            errors.append((index, error))
+            continue
+        timer.add(stage, time.perf_counter() - start)
+        target.put((index, result))
+
+    for _ in range(outputs):
+        target.put(_DONE)
+
+def run_pipeline(items, read, process, write, readers=2, writers=2, queue_size=8, timer=None):
+    """
+    Run items through read, process and write stages that overlap with each other.
+
+    Reading and writing run in pools of threads, processing runs in a single thread, and the
+    stages are connected by bounded queues, so only a few times queue_size items are in
+    flight at once. Results are yielded in the order of the items.
+
+    When a stage raises, no further items are fed in, but the items ahead of the failed one
+    that are already in flight still go through every stage. All results before the failed
+    item are yielded, and then the exception of the earliest failed item is raised.
+
+    Parameters:
+    - items (iterable): Items to process.
+    - read (callable): Function mapping an item to its loaded data.
+    - process (callable): Function mapping an item and its data to the processed output.
+    - write (callable): Function mapping an item, its data and its output to the result.
+    - readers (int): Number of reading threads.
+    - writers (int): Number of writing threads.
+    - queue_size (int): Maximum number of items waiting between two stages.
+    - timer (StageTimer, optional): Timer the busy time of each stage is recorded in.
+
+    Yields:
+    - Results of write in the order of the items.
+    """
+    timer = timer if timer is not None else StageTimer()
+    errors = []
+
+    item_queue = queue.Queue(queue_size)
+    read_queue = queue.Queue(queue_size)
+    process_queue = queue.Queue(queue_size)
+    result_queue = queue.Queue()
+
+    def feed():
+        for index, item in enumerate(items):
+            if errors:
+                break
+            item_queue.put((index, (item,)))
+        for _ in range(readers):
+            item_queue.put(_DONE)
+
+    # Each stage passes the item along with everything computed for it so far
+    stages = [
+        (lambda item: (item, read(item)), 'read', item_queue, read_queue, 1, 1, readers),
+        (lambda item, data: (item, data, process(item, data)), 'process', read_queue, process_queue, readers, writers, 1),
+        (write, 'write', process_queue, result_queue, 1, 1, writers),
+    ]
+
+    threads = [threading.Thread(target=feed, daemon=True)]
+    for function, stage, source, target, inputs, outputs, count in stages:
+        threads += [threading.Thread(target=_worker, args=(function, stage, timer, source, target, errors, inputs, outputs), daemon=True)
+                    for _ in range(count)]
+    for thread in threads:
+        thread.start()
+
+    # Yield the results in item order as they arrive from the writers
+    pending = {}
+    next_index = 0
+    done = 0
+    while done < writers:
+        entry = result_queue.get()
+        if entry is _DONE:
+            done += 1
+            continue
+        index, result = entry
+        pending[index] = result
+        while next_index in pending:
+            yield pending.pop(next_index)
+            next_index += 1
+
+    if errors:
+        raise min(errors, key=lambda error: error[0])[1]
@@ -1,29 +1,189 @@
 import os
 import cv2
+import multiprocessing
 import numpy as np
-import tensorflow as tf
 from tqdm import tqdm
 
+from scripts import profiler
+
+# Keypoints with a confidence at or below this value are not drawn
+CONFIDENCE_THRESHOLD = 0.2
+
+# PoseNet detector of the current process used by detect_poses, set by init_worker
+_worker_detector = None
+
+def load_interpreter(model_path, num_threads=None):
+    """
+    Create a TensorFlow Lite interpreter for the model.
+
+    The lightweight tflite_runtime package is used when it is installed, otherwise the interpreter
+    of the full TensorFlow package. The import happens here rather than at module level, so
+    importing this module does not load TensorFlow.
+
+    Parameters:
+    - model_path (str): Path to the TensorFlow Lite model file.
+    - num_threads (int, optional): Number of threads used by the interpreter.
+
+    Returns:
+    - Interpreter with the tf.lite.Interpreter API.
+    """
+    try:
+        from tflite_runtime.interpreter import Interpreter
+    except ImportError:
+        import tensorflow as tf
+        Interpreter = tf.lite.Interpreter
+    return Interpreter(model_path=model_path, num_threads=num_threads)
+
 class PoseNetDetector:
     """
     Class for detecting poses using the PoseNet model.
 
     Attributes:
     - interpreter: TensorFlow Lite interpreter for running inference.
+    - input_index (int): Index of the input tensor.
+    - input_shape (numpy.ndarray): Shape of the input tensor for a single image.
+    - input_size (tuple): Width and height images are resized to.
+    - output_indices (list): Indices of the output tensors.
+    - batch_size (int): Batch size the input tensor is currently allocated for.
+    - batching (bool): Whether the model accepts an input tensor resized to a batch of images.
+    - batch_checked (bool): Whether a batch of the current size has run and returned one output row per image.
     """
 
-    def __init__(self, model_path):
+    def __init__(self, model_path, num_threads=None, interpreter=None):
         """
         Initialize the PoseNetDetector with the given TensorFlow Lite model.
 
         Parameters:
         - model_path (str): Path to the TensorFlow Lite model file.
+        - num_threads (int, optional): Number of threads used by the interpreter.
+        - interpreter (optional): Interpreter with the tf.lite.Interpreter API to use instead of loading model_path.
+
+        Returns:
+        - None
+        """
+        if interpreter is None:
+            interpreter = load_interpreter(model_path, num_threads)
+        self.interpreter = interpreter
+        self.interpreter.allocate_tensors()
+
+        # Cache tensor indices and shapes instead of querying them on every call
+        input_details = self.interpreter.get_input_details()[0]
+        self.input_index = input_details['index']
+        self.input_shape = input_details['shape'].copy()
+        self.input_size = (int(self.input_shape[2]), int(self.input_shape[1]))
+        self.output_indices = [output['index'] for output in self.interpreter.get_output_details()]
+
+        self.batch_size = int(self.input_shape[0])
+        self.batching = True
+        self.batch_checked = False
+        self.input_buffer = np.zeros(self.input_shape, dtype=np.uint8)
+
+    def _allocate(self, batch_size):
+        """
+        Resize the input tensor and the input buffer to the given batch size.
+
+        Parameters:
+        - batch_size (int): Number of images in a batch.
 
         Returns:
         - None
         """
-        self.interpreter = tf.lite.Interpreter(model_path=model_path)
+        self.interpreter.resize_tensor_input(self.input_index, [batch_size, *self.input_shape[1:]])
         self.interpreter.allocate_tensors()
+        self.batch_size = batch_size
+        self.batch_checked = False
+        self.input_buffer = np.zeros((batch_size, *self.input_shape[1:]), dtype=np.uint8)
+
+    def reserve(self, batch_size):
+        """
+        Allocate the input tensor for batches of up to batch_size images.
+
+        Smaller batches are padded into the allocated input, so batches of varying size, as formed
+        by the server, share a single allocation instead of resizing the tensor for every size.
+
+        Parameters:
+        - batch_size (int): Largest number of images in a batch.
+
+        Returns:
+        - None
+        """
+        if self.batching and batch_size > self.batch_size:
+            try:
+                self._allocate(batch_size)
+            except (ValueError, RuntimeError):
+                self._stop_batching()
+
+    def _stop_batching(self):
+        """
+        Switch to running images one by one after the model rejected a batch.
+
+        The input tensor may have been resized even though allocating it failed, so it is
+        always resized back to a single image rather than trusting the recorded batch size.
+
+        Returns:
+        - None
+        """
+        self.batching = False
+        self._allocate(1)
+
+    def _invoke(self):
+        """
+        Run inference on the input buffer.
+
+        Returns:
+        - List of numpy.ndarrays: Output tensors, with one row per image in the input buffer.
+        """
+        self.interpreter.set_tensor(self.input_index, self.input_buffer)
+        with profiler.timer('posenet.invoke'):
+            self.interpreter.invoke()
+
+        return [self.interpreter.get_tensor(index) for index in self.output_indices]
+
+    def _run(self, images):
+        """
+        Run inference on a batch of images.
+
+        The whole batch runs in one invoke(). The input tensor only grows when a batch is larger
+        than its allocated size, and smaller batches are padded, with the outputs of the padding
+        rows dropped. If the model does not accept a resized input tensor, fails on the first
+        invoke() at a new size, or returns a different number of output rows than the input has,
+        the images are run one by one through the pre-allocated single-image input buffer instead.
+        Errors of later invoke() calls at a size that already worked are raised.
+
+        Parameters:
+        - images (list): Input images to detect poses from.
+
+        Returns:
+        - List of numpy.ndarrays: Output tensors, with one row per image.
+        """
+        self.reserve(len(images))
+
+        profiler.count('posenet.images', len(images))
+        if self.batching:
+            with profiler.timer('posenet.resize'):
+                for i, image in enumerate(images):
+                    self.input_buffer[i] = cv2.resize(image, self.input_size)
+            try:
+                output_data = self._invoke()
+            except (ValueError, RuntimeError):
+                # Only the first invoke() at a new size tells whether the model takes batches
+                if self.batch_checked:
+                    raise
+                output_data = None
+
+            # A model with a fixed output batch returns fewer rows than the input has
+            if output_data is not None and all(len(output) == self.batch_size for output in output_data):
+                self.batch_checked = True
+                return [output[:len(images)] for output in output_data]
+            self._stop_batching()
+
+        # Fall back to one invoke() per image
+        image_outputs = []
+        for image in images:
+            with profiler.timer('posenet.resize'):
+                self.input_buffer[0] = cv2.resize(image, self.input_size)
+            image_outputs.append(self._invoke())
+        return [np.concatenate(outputs) for outputs in zip(*image_outputs)]
 
     def process_image(self, image):
         """
@@ -35,20 +195,80 @@ class PoseNetDetector:
         Returns:
         - List of numpy.ndarrays: Detected pose keypoints.
         """
-        input_details = self.interpreter.get_input_details()
-        output_details = self.interpreter.get_output_details()
+        return self.process_batch([image])[0]
 
-        input_shape = input_details[0]['shape']
-        input_data = np.expand_dims(cv2.resize(image, (input_shape[1], input_shape[2])), axis=0)
+    def process_batch(self, images):
+        """
+        Process a batch of images to detect poses using the PoseNet model.
+
+        Parameters:
+        - images (list): Input images to detect poses from.
+
+        Returns:
+        - List of lists of numpy.ndarrays: Detected pose keypoints for each image.
+        """
+        if not images:
+            return []
+
+        output_data = self._run(images)
+        return [[output[i:i + 1] for output in output_data] for i in range(len(images))]
+
+    def detect(self, image):
+        """
+        Detect poses in an image and return their keypoints as an array.
+
+        Parameters:
+        - image (numpy.ndarray): Input image to detect poses from.
+
+        Returns:
+        - numpy.ndarray: Array of shape (P, 17, 3) with 'y', 'x' and 'confidence' values for each of the P detected poses.
+        """
+        return self.detect_batch([image])[0]
+
+    def detect_batch(self, images):
+        """
+        Detect poses in a batch of images and return their keypoints as an array.
+
+        Parameters:
+        - images (list): Input images to detect poses from.
+
+        Returns:
+        - numpy.ndarray: Array of shape (N, P, 17, 3) with 'y', 'x' and 'confidence' values for each of the P poses detected on each of the N images.
+        """
+        if not images:
+            return np.zeros((0, 1, 17, 3), dtype=np.float32)
+        return decode_keypoints(self._run(images))
+
+def decode_keypoints(output_data):
+    """
+    Convert the output tensors of the PoseNet model to a keypoints array.
+
+    Parameters:
+    - output_data (list): Output tensors of shape (N, 1, 17, 3), one per detected pose.
+
+    Returns:
+    - numpy.ndarray: Array of shape (N, P, 17, 3), a view of the output tensor if the model has a single output.
+    """
+    if len(output_data) == 1:
+        return output_data[0].reshape(len(output_data[0]), -1, 17, 3)
+    return np.concatenate([output.reshape(len(output), -1, 17, 3) for output in output_data], axis=1)
 
-        input_data = np.uint8(input_data)
+def keypoint_pixels(keypoints, shape, threshold=CONFIDENCE_THRESHOLD):
+    """
+    Select the confident keypoints and scale them to pixel coordinates.
 
-        self.interpreter.set_tensor(input_details[0]['index'], input_data)
-        self.interpreter.invoke()
+    Parameters:
+    - keypoints (numpy.ndarray): Array of shape (..., 17, 3) with 'y', 'x' and 'confidence' values.
+    - shape (tuple): Shape of the image the keypoints were detected on.
+    - threshold (float): Keypoints with a confidence at or below the threshold are dropped.
+
+    Returns:
+    - numpy.ndarray: Array of shape (K, 2) with the integer 'x' and 'y' pixel coordinates of the confident keypoints.
+    """
+    keypoints = np.asarray(keypoints).reshape(-1, 3)
+    keypoints = keypoints[keypoints[:, 2] > threshold]
+    return (keypoints[:, 1::-1] * (shape[1], shape[0])).astype(np.int64)
 
-        output_data = [self.interpreter.get_tensor(output_details[i]['index']) for i in range(len(output_details))]
-        return output_data
-    
 def process_output(output_data):
     """
     Process the output data from the PoseNet model to extract keypoints.
@@ -66,32 +286,72 @@ def process_output(output_data):
         processed_keypoints.append({'y': y, 'x': x, 'confidence': confidence})
     return processed_keypoints
 
+@profiler.timed('draw_poses')
 def draw_poses(image, output_data):
     """
     Draw detected poses on the input image.
 
     Parameters:
     - image (numpy.ndarray): Input image to draw poses on.
-    - output_data (list): Detected pose keypoints.
+    - output_data (list or numpy.ndarray): Detected pose keypoints, as returned by process_image or detect.
+
+    Returns:
+    - None
+    """
+    if isinstance(output_data, np.ndarray):
+        keypoints = output_data
+    else:
+        keypoints = decode_keypoints(output_data) if len(output_data) else np.zeros((0, 17, 3))
+
+    for x, y in keypoint_pixels(keypoints, image.shape).tolist():
+        cv2.circle(image, (x, y), 5, (0, 255, 0), -1)
+
+def init_worker(model_path, num_threads=None):
+    """
+    Create the PoseNet detector used by detect_files in the current process.
+
+    Parameters:
+    - model_path (str): Path to the TensorFlow Lite model file.
+    - num_threads (int, optional): Number of threads used by the interpreter.
 
     Returns:
     - None
     """
-    for pose_data in output_data:
-        keypoints = process_output(pose_data)
-        if keypoints is not None:
-            for keypoint in keypoints:
-                if keypoint['confidence'] > 0.2: 
-                    cv2.circle(image, (int(keypoint['x'] * image.shape[1]), int(keypoint['y'] * image.shape[0])), 5, (0, 255, 0), -1)
+    global _worker_detector
+    _worker_detector = PoseNetDetector(model_path, num_threads)
+
+def detect_files(task):
+    """
+    Detect poses in a batch of image files, draw them and save the pose-detected images.
+
+    Parameters:
+    - task (tuple): Input folder, output folder and file names of the batch.
+
+    Returns:
+    - list: File names of the batch.
+    """
+    input_folder, output_folder, filenames = task
 
-def detect_poses(input_folder, output_folder, model_path):
+    images = [cv2.imread(os.path.join(input_folder, filename)) for filename in filenames]
+    for filename, image, keypoints in zip(filenames, images, _worker_detector.detect_batch(images)):
+        draw_poses(image, keypoints)
+        cv2.imwrite(os.path.join(output_folder, filename), image)
+    return filenames
+
+def detect_poses(input_folder, output_folder, model_path, num_threads=None, batch_size=8, workers=1):
     """
     Detect poses in images from the input folder and save the result in the output folder.
 
+    Images are passed to the detector in batches, and with several workers the batches are
+    shared out to a process pool, each process running its own PoseNetDetector.
+
     Parameters:
     - input_folder (str): Path to the input folder containing images.
     - output_folder (str): Path to the output folder where the pose-detected images will be saved.
     - model_path (str): Path to the TensorFlow Lite model file.
+    - num_threads (int, optional): Number of threads used by the interpreter of each worker.
+    - batch_size (int): Number of images passed to the detector per inference.
+    - workers (int): Number of processes running pose detection.
 
     Returns:
     - None
@@ -100,26 +360,32 @@ def detect_poses(input_folder, output_folder, model_path):
     if not os.path.exists(output_folder):
         os.makedirs(output_folder)
 
-    # Initialize PoseNet detector
-    posenet_detector = PoseNetDetector(model_path)
-
-    # Process images in the input folder
-    for filename in tqdm(os.listdir(input_folder)):
-        if filename.endswith(".jpg") or filename.endswith(".png"):
-            image_path = os.path.join(input_folder, filename)
-            image = cv2.imread(image_path)
-
-            # Detect poses in the image
-            poses = posenet_detector.process_image(image)
-
-            # Draw detected poses on the image
-            draw_poses(image, poses)
+    # Split the images in the input folder into batches
+    filenames = sorted(filename for filename in os.listdir(input_folder) if filename.endswith(".jpg") or filename.endswith(".png"))
+    tasks = [(input_folder, output_folder, filenames[start:start + batch_size]) for start in range(0, len(filenames), batch_size)]
 
-            # Save the image with detected poses
-            cv2.imwrite(os.path.join(output_folder, filename), image)
+    if workers > 1:
+        # Each worker process sets up its own PoseNet detector
+        pool = multiprocessing.get_context('spawn').Pool(workers, initializer=init_worker, initargs=(model_path, num_threads))
+        results = pool.imap_unordered(detect_files, tasks)
+    else:
+        pool = None
+        init_worker(model_path, num_threads)
+        results = map(detect_files, tasks)
 
-            # Print progress information
-            print(f"Processed image: {filename}")
+    with tqdm(total=len(filenames)) as progress:
+        try:
+            for batch in results:
+                progress.update(len(batch))
+        except BaseException:
+            # Stop the queued tasks, instead of waiting for all of them before the error comes out
+            if pool is not None:
+                pool.terminate()
+            raise
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
 
 if __name__ == "__main__":
     # Input and output paths
@@ -0,0 +1,311 @@
+import os
+import json
+import time
+import random
+import threading
+import functools
+import numpy as np
+
+# Profiling is off by default, and timer() then returns a shared no-op timer
+_enabled = False
+_tracing = False
+_lock = threading.Lock()
+_samples = {}
+_counters = {}
+_events = []
+
+# Maximum number of trace events kept, so long runs do not grow without bound
+MAX_EVENTS = 1000000
+
+# Maximum number of durations kept per timer for the percentiles, the call count and total time stay exact
+MAX_SAMPLES = 10000
+
+_random = random.Random()
+
+class _Samples:
+    """
+    Call count, total time and a uniform random sample of the durations of one timer.
+
+    Attributes:
+    - count (int): Number of recorded calls.
+    - total (int): Total duration of the calls in nanoseconds.
+    - durations (list): At most MAX_SAMPLES durations in nanoseconds, every call kept with the same probability.
+    """
+    __slots__ = ('count', 'total', 'durations')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.durations = []
+
+    def add(self, duration):
+        # Reservoir sampling: the n-th call replaces a kept duration with probability MAX_SAMPLES / n
+        self.count += 1
+        self.total += duration
+        if len(self.durations) < MAX_SAMPLES:
+            self.durations.append(duration)
+        else:
+            i = _random.randrange(self.count)
+            if i < MAX_SAMPLES:
+                self.durations[i] = duration
+
+    def update(self, other):
+        if len(other.durations) == other.count:
+            for duration in other.durations:
+                self.add(duration)
+            return
+
+        # Both hold samples, keep durations of each in proportion to the calls they stand for
+        count = self.count + other.count
+        size = min(len(self.durations) + len(other.durations), MAX_SAMPLES)
+        own = min(round(size * self.count / count), len(self.durations))
+        theirs = min(size - own, len(other.durations))
+        self.durations = _random.sample(self.durations, own) + _random.sample(other.durations, theirs)
+        self.count = count
+        self.total += other.total
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        return False
+
+_NULL_TIMER = _NullTimer()
+
+class _Timer:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *_):
+        record(self.name, self.start, time.perf_counter_ns() - self.start)
+        return False
+
+def enable(trace=False):
+    """
+    Turn profiling on in the current process.
+
+    Parameters:
+    - trace (bool): Whether to also keep every timed call as an event for the Chrome trace.
+
+    Returns:
+    - None
+    """
+    global _enabled, _tracing
+    _enabled = True
+    _tracing = trace
+
+def enabled():
+    return _enabled
+
+def options():
+    """
+    Get the profiling settings of the current process, to enable the same profiling in worker processes.
+
+    Returns:
+    - tuple: Whether profiling and tracing are enabled.
+    """
+    return _enabled, _tracing
+
+def configure(profile, trace=False):
+    """
+    Apply profiling settings returned by options, for use in the initializer of worker processes.
+
+    Parameters:
+    - profile (bool): Whether profiling is enabled.
+    - trace (bool): Whether tracing is enabled.
+
+    Returns:
+    - None
+    """
+    if profile:
+        enable(trace)
+
+def timer(name):
+    """
+    Time a block of code.
+
+    Parameters:
+    - name (str): Name of the timed stage.
+
+    Returns:
+    - Context manager recording the duration of the block, or a no-op when profiling is off.
+    """
+    return _Timer(name) if _enabled else _NULL_TIMER
+
+def timed(name):
+    """
+    Decorator timing every call of a function.
+
+    Parameters:
+    - name (str): Name of the timed stage.
+
+    Returns:
+    - callable: Decorator.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            with _Timer(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def count(name, value=1):
+    """
+    Increase a counter.
+
+    Parameters:
+    - name (str): Name of the counter.
+    - value (int): Amount to add.
+
+    Returns:
+    - None
+    """
+    if _enabled:
+        with _lock:
+            _counters[name] = _counters.get(name, 0) + value
+
+def record(name, start, duration):
+    """
+    Record a timed call.
+
+    Parameters:
+    - name (str): Name of the timed stage.
+    - start (int): Start of the call from time.perf_counter_ns().
+    - duration (int): Duration of the call in nanoseconds.
+
+    Returns:
+    - None
+    """
+    with _lock:
+        if name not in _samples:
+            _samples[name] = _Samples()
+        _samples[name].add(duration)
+        if _tracing and len(_events) < MAX_EVENTS:
+            _events.append((name, start, duration, os.getpid(), threading.get_ident()))
+
+def collect():
+    """
+    Take the samples, counters and events recorded so far in this process and clear them.
+
+    Returns:
+    - dict: Recorded samples, counters and events, to be passed to merge in another process.
+    """
+    global _samples, _counters, _events
+    with _lock:
+        snapshot = {'samples': _samples, 'counters': _counters, 'events': _events}
+        _samples, _counters, _events = {}, {}, []
+    return snapshot
+
+def merge(snapshot):
+    """
+    Add samples, counters and events collected in another process.
+
+    Parameters:
+    - snapshot (dict): Data returned by collect.
+
+    Returns:
+    - None
+    """
+    with _lock:
+        for name, samples in snapshot['samples'].items():
+            if name not in _samples:
+                _samples[name] = _Samples()
+            _samples[name].update(samples)
+        for name, value in snapshot['counters'].items():
+            _counters[name] = _counters.get(name, 0) + value
+        _events.extend(snapshot['events'][:max(MAX_EVENTS - len(_events), 0)])
+
+def collecting(function, argument):
+    """
+    Call a function and collect the profiling data it recorded, for use as the task function of worker processes.
+
+    Parameters:
+    - function (callable): Task function.
+    - argument: Argument of the task function.
+
+    Returns:
+    - tuple: Result of the call and the snapshot returned by collect.
+    """
+    return function(argument), collect()
+
+def merge_results(results):
+    """
+    Merge the profiling data returned along with results of worker processes.
+
+    Parameters:
+    - results (iterable): Pairs of result and the snapshot collected after computing it.
+
+    Yields:
+    - Results without the snapshots.
+    """
+    for result, snapshot in results:
+        merge(snapshot)
+        yield result
+
+def report():
+    """
+    Summarize the recorded timers and counters.
+
+    The percentiles are estimated from at most MAX_SAMPLES durations per timer.
+
+    Returns:
+    - dict: For every timer its call count, total time in seconds and p50, p95 and p99 duration
+      in milliseconds, and the value of every counter.
+    """
+    with _lock:
+        samples = {name: (stats.count, stats.total, np.array(stats.durations) / 1e6) for name, stats in _samples.items()}
+        counters = dict(_counters)
+
+    timers = {}
+    for name, (count, total, durations) in sorted(samples.items()):
+        p50, p95, p99 = np.percentile(durations, [50, 95, 99])
+        timers[name] = {'count': count, 'total_s': total / 1e9,
+                        'p50_ms': float(p50), 'p95_ms': float(p95), 'p99_ms': float(p99)}
+    return {'timers': timers, 'counters': counters}
+
+def format_report():
+    """
+    Format the per-stage breakdown as a table, slowest stage first.
+
+    Returns:
+    - str: One line per timer and counter.
+    """
+    summary = report()
+    lines = [f"{'stage':<28}{'count':>10}{'total s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"]
+    for name, timer_report in sorted(summary['timers'].items(), key=lambda item: -item[1]['total_s']):
+        lines.append(f"{name:<28}{timer_report['count']:>10}{timer_report['total_s']:>10.2f}"
+                     f"{timer_report['p50_ms']:>10.2f}{timer_report['p95_ms']:>10.2f}{timer_report['p99_ms']:>10.2f}")
+    for name, value in sorted(summary['counters'].items()):
+        lines.append(f"{name:<28}{value:>10}")
+    return "\n".join(lines)
+
+def save_trace(path):
+    """
+    Save the recorded events in the Chrome trace format, viewable in chrome://tracing or Perfetto.
+
+    Parameters:
+    - path (str): Path to the JSON file.
+
+    Returns:
+    - None
+    """
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+
+    with _lock:
+        events = list(_events)
+    trace = [{'name': name, 'ph': 'X', 'ts': start / 1000, 'dur': duration / 1000, 'pid': pid, 'tid': tid}
+             for name, start, duration, pid, tid in events]
+    with open(path, 'w') as file:
+        json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, file)
@@ -0,0 +1,208 @@
+import cv2
+import json
+import time
+import queue
+import threading
+import collections
+import numpy as np
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from scripts.addlogger import calculate_features
+
+class MicroBatcher:
+    """
+    Class for coalescing concurrent detection requests into batches for a single detector.
+
+    A worker thread waits for the first pending image, then collects more images until the batch
+    is full or the oldest image has waited max_wait seconds, and runs the whole batch in one inference.
+
+    Attributes:
+    - detector (PoseNetDetector): Detector shared by all requests.
+    - batch_size (int): Maximum number of images per inference.
+    - max_wait (float): Maximum time in seconds an image waits for a batch to fill.
+    """
+
+    def __init__(self, detector, batch_size=8, max_wait=0.005, window=1000):
+        """
+        Initialize the MicroBatcher and start its worker thread.
+
+        Parameters:
+        - detector (PoseNetDetector): Detector shared by all requests.
+        - batch_size (int): Maximum number of images per inference.
+        - max_wait (float): Maximum time in seconds an image waits for a batch to fill.
+        - window (int): Number of recent requests the latency percentiles are measured over.
+
+        Returns:
+        - None
+        """
+        self.detector = detector
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+
+        # Batches of every size up to batch_size run on the same input tensor allocation
+        detector.reserve(batch_size)
+
+        self._requests = queue.Queue()
+        self._lock = threading.Lock()
+        self._latencies = collections.deque(maxlen=window)
+        self._counts = {'requests': 0, 'batches': 0, 'errors': 0}
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, image):
+        """
+        Queue an image for detection.
+
+        Parameters:
+        - image (numpy.ndarray): Input image to detect poses from.
+
+        Returns:
+        - concurrent.futures.Future: Future resolving to the keypoint array of shape (P, 17, 3).
+        """
+        future = Future()
+        self._requests.put((time.perf_counter(), image, future))
+        return future
+
+    def _collect(self):
+        # Block for the first request, then take more until the batch is full or its deadline passes
+        batch = [self._requests.get()]
+        deadline = batch[0][0] + self.max_wait
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.perf_counter()
+            try:
+                batch.append(self._requests.get(timeout=timeout) if timeout > 0 else self._requests.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                batch_keypoints = self.detector.detect_batch([image for _, image, _ in batch])
+            except Exception as error:
+                with self._lock:
+                    self._counts['errors'] += len(batch)
+                for _, _, future in batch:
+                    future.set_exception(error)
+                continue
+
+            now = time.perf_counter()
+            with self._lock:
+                self._counts['requests'] += len(batch)
+                self._counts['batches'] += 1
+                self._latencies.extend(now - submitted for submitted, _, _ in batch)
+            for (_, _, future), keypoints in zip(batch, batch_keypoints):
+                future.set_result(keypoints)
+
+    def metrics(self):
+        """
+        Get the queue depth, request counts, mean batch size and latency percentiles.
+
+        Returns:
+        - dict: Metrics of the batcher, with latencies in milliseconds measured from submit to result.
+        """
+        with self._lock:
+            counts = dict(self._counts)
+            latencies = np.array(self._latencies) * 1000
+
+        metrics = dict(counts, queue_depth=self._requests.qsize(), batch_size=self.batch_size, max_wait_ms=self.max_wait * 1000)
+        metrics['mean_batch_size'] = counts['requests'] / counts['batches'] if counts['batches'] else None
+        for percentile in (50, 95, 99):
+            metrics[f"p{percentile}_ms"] = float(np.percentile(latencies, percentile)) if len(latencies) else None
+        return metrics
+
+def pose_response(keypoints, classifier=None):
+    """
+    Build the JSON response of a detected image.
+
+    Parameters:
+    - keypoints (numpy.ndarray): Array of shape (P, 17, 3) with 'y', 'x' and 'confidence' values.
+    - classifier (PostureClassifier, optional): Classifier to add the label probabilities of each pose.
+
+    Returns:
+    - dict: Keypoints and torso features of each pose, with missing features as None.
+    """
+    features = calculate_features(keypoints)
+    response = {
+        'keypoints': keypoints.tolist(),
+        'features': {name: [None if np.isnan(value) else value for value in values.tolist()] for name, values in features.items()},
+    }
+    if classifier is not None:
+        response['probabilities'] = classifier.score(keypoints).tolist()
+    return response
+
+class PoseRequestHandler(BaseHTTPRequestHandler):
+    """
+    Handler of the pose server.
+
+    POST /detect takes an encoded image (JPEG, PNG or any format cv2.imdecode reads) as the request
+    body and returns its keypoints and torso features. GET /metrics returns the batcher metrics and
+    GET /health reports that the server is up.
+    """
+
+    def _send_json(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            self._send_json(200, self.server.batcher.metrics())
+        elif self.path == '/health':
+            self._send_json(200, {'status': 'ok'})
+        else:
+            self._send_json(404, {'error': f"Unknown path {self.path}"})
+
+    def do_POST(self):
+        if self.path != '/detect':
+            self._send_json(404, {'error': f"Unknown path {self.path}"})
+            return
+
+        start = time.perf_counter()
+        data = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR) if data else None
+        if image is None:
+            self._send_json(400, {'error': "Request body is not a readable image"})
+            return
+
+        try:
+            keypoints = self.server.batcher.submit(image).result(self.server.timeout_seconds)
+        except Exception as error:
+            self._send_json(500, {'error': str(error)})
+            return
+
+        response = pose_response(keypoints, self.server.classifier)
+        response['latency_ms'] = (time.perf_counter() - start) * 1000
+        self._send_json(200, response)
+
+    def log_message(self, format, *args):
+        # Access logs of every request would slow the server down
+        pass
+
+def create_server(detector, host='127.0.0.1', port=8000, batch_size=8, max_wait=0.005, classifier=None, timeout=30.0):
+    """
+    Create the pose server around a loaded detector.
+
+    Parameters:
+    - detector (PoseNetDetector): Detector shared by all requests.
+    - host (str): Address to listen on.
+    - port (int): Port to listen on, 0 to pick a free port.
+    - batch_size (int): Maximum number of images per inference.
+    - max_wait (float): Maximum time in seconds an image waits for a batch to fill.
+    - classifier (PostureClassifier, optional): Classifier to add the label probabilities of each pose.
+    - timeout (float): Maximum time in seconds a request waits for its result.
+
+    Returns:
+    - http.server.ThreadingHTTPServer: Server, to be run with serve_forever.
+    """
+    server = ThreadingHTTPServer((host, port), PoseRequestHandler)
+    server.daemon_threads = True
+    server.batcher = MicroBatcher(detector, batch_size, max_wait)
+    server.classifier = classifier
+    server.timeout_seconds = timeout
+    return server
@@ -0,0 +1,217 @@
+import os
+import re
+import json
+import shutil
+import hashlib
+
+from scripts.inferencecache import file_hash
+from scripts.keypointstore import load_keypoints, merge_parts
+
+# Suffix augmented_name adds to the name of an augmented copy
+AUGMENTED_SUFFIX = re.compile(r'_aug_\d+$')
+
+def parse_shard(text):
+    """
+    Parse a shard given as 'i/N' on the command line.
+
+    Parameters:
+    - text (str): Index of the shard, starting from 0, and the number of shards, separated by a slash.
+
+    Returns:
+    - tuple: Index and number of shards.
+    """
+    index, _, count = text.partition('/')
+    index, count = int(index), int(count)
+    if not 0 <= index < count:
+        raise ValueError(f"shard index {index} is not between 0 and {count - 1}")
+    return index, count
+
+def shard_key(filename):
+    """
+    Get the name an image is assigned to a shard by.
+
+    The key is the file name without its extension and without the suffix of augmented copies,
+    so an original image and all of its augmented copies end up in the same shard, and the key
+    does not depend on the folder the images are stored in on a particular machine.
+
+    Parameters:
+    - filename (str): File name of an original or augmented image.
+
+    Returns:
+    - str: Shard key.
+    """
+    return AUGMENTED_SUFFIX.sub('', filename.split('.')[0])
+
+def shard_of(filename, count):
+    """
+    Get the shard of an image by a stable hash of its shard key.
+
+    Unlike the built-in hash, the hash does not change between processes and machines.
+
+    Parameters:
+    - filename (str): File name of an original or augmented image.
+    - count (int): Number of shards.
+
+    Returns:
+    - int: Index of the shard.
+    """
+    digest = hashlib.sha1(shard_key(filename).encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % count
+
+def in_shard(filename, shard):
+    """
+    Check whether an image belongs to a shard.
+
+    Parameters:
+    - filename (str): File name of an original or augmented image.
+    - shard (tuple, optional): Index and number of shards, None for a run without shards.
+
+    Returns:
+    - bool: Whether the image is processed by the shard.
+    """
+    return shard is None or shard_of(filename, shard[1]) == shard[0]
+
+def shard_path(path, shard):
+    """
+    Get the path of the part file a shard writes instead of the given output file.
+
+    Parameters:
+    - path (str): Path to the output file of a run without shards.
+    - shard (tuple): Index and number of shards.
+
+    Returns:
+    - str: Path with the shard inserted before the extension, e.g. keypoints.shard-00001-of-00004.npy.
+    """
+    base, extension = os.path.splitext(path)
+    return f"{base}.shard-{shard[0]:05d}-of-{shard[1]:05d}{extension}"
+
+def file_entry(path, rows):
+    """
+    Describe a file for the checksum manifest.
+
+    Parameters:
+    - path (str): Path to the file.
+    - rows (int): Number of rows in the file.
+
+    Returns:
+    - dict: Path, number of rows, size and SHA-256 hash of the file.
+    """
+    return {'path': path, 'rows': rows, 'bytes': os.path.getsize(path), 'sha256': file_hash(path)}
+
+def csv_rows(path):
+    """
+    Count the data rows of a CSV file with a header line.
+
+    Parameters:
+    - path (str): Path to the CSV file.
+
+    Returns:
+    - int: Number of lines after the header.
+    """
+    with open(path, 'rb') as file:
+        return max(sum(1 for _ in file) - 1, 0)
+
+def merge_csv(part_paths, path):
+    """
+    Concatenate CSV files with the same header into one file, keeping the header of the first file only.
+
+    The files are copied in blocks, so no file is parsed or held in memory.
+
+    Parameters:
+    - part_paths (list): Paths to the CSV files in the order of their rows.
+    - path (str): Path to the merged CSV file.
+
+    Returns:
+    - None
+    """
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+
+    with open(path, 'wb') as output:
+        for i, part_path in enumerate(part_paths):
+            with open(part_path, 'rb') as part:
+                header = part.readline()
+                if i == 0:
+                    output.write(header)
+                shutil.copyfileobj(part, output)
+
+def write_manifest(manifest, path):
+    """
+    Write the checksum manifest of a merge.
+
+    Parameters:
+    - manifest (dict): Checksum manifest.
+    - path (str): Path to the JSON file.
+
+    Returns:
+    - None
+    """
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+
+    with open(path, 'w') as file:
+        json.dump(manifest, file, indent=2)
+
+def merge_shards(count, keypoints_path, dataset_path, manifest_path=None):
+    """
+    Merge the keypoint stores and datasets written by the shards of a sharded build.
+
+    The shard files are concatenated in shard order, and every shard lists its rows by class and
+    file name, so the merged files only depend on the inputs and the number of shards, not on
+    which machine built a shard or when. The rows are ordered shard by shard, so merging a
+    different number of shards, or an unsharded build, gives the same rows in another order.
+    The size, number of rows and SHA-256 hash of every shard file and of the merged files are
+    written to a JSON manifest.
+
+    Every shard is checked before anything is merged. Missing shard files and shards whose keypoint
+    and dataset rows do not match are all listed under 'problems' in the manifest, and the merge is
+    refused with a ValueError.
+
+    Parameters:
+    - count (int): Number of shards.
+    - keypoints_path (str): Path to the merged keypoint store (.npy), the shard stores are found next to it.
+    - dataset_path (str): Path to the merged dataset CSV file, the shard datasets are found next to it.
+    - manifest_path (str, optional): Path to the checksum manifest, next to the keypoint store by default.
+
+    Returns:
+    - dict: Checksum manifest.
+    """
+    shards = [(i, count) for i in range(count)]
+    keypoints_parts = [shard_path(keypoints_path, shard) for shard in shards]
+    dataset_parts = [shard_path(dataset_path, shard) for shard in shards]
+    if manifest_path is None:
+        manifest_path = f"{os.path.splitext(keypoints_path)[0]}.manifest.json"
+
+    manifest = {'shards': [], 'problems': []}
+    for shard, keypoints_part, dataset_part in zip(shards, keypoints_parts, dataset_parts):
+        entry = {'shard': f"{shard[0]}/{shard[1]}", 'keypoints': None, 'dataset': None}
+
+        # Every shard has to be finished before merging
+        if os.path.exists(keypoints_part):
+            entry['keypoints'] = file_entry(keypoints_part, len(load_keypoints(keypoints_part)))
+        else:
+            manifest['problems'].append(f"Shard {entry['shard']} is missing {keypoints_part}")
+        if os.path.exists(dataset_part):
+            entry['dataset'] = file_entry(dataset_part, csv_rows(dataset_part))
+        else:
+            manifest['problems'].append(f"Shard {entry['shard']} is missing {dataset_part}")
+
+        # The dataset has one row per keypoint row, unless it was generated from other keypoints
+        if entry['keypoints'] is not None and entry['dataset'] is not None and entry['keypoints']['rows'] != entry['dataset']['rows']:
+            manifest['problems'].append(f"Shard {entry['shard']} has {entry['keypoints']['rows']} keypoint rows but {entry['dataset']['rows']} dataset rows")
+        manifest['shards'].append(entry)
+
+    if manifest['problems']:
+        write_manifest(manifest, manifest_path)
+        raise ValueError(f"{len(manifest['problems'])} problems in the shards, see {manifest_path}:\n" + "\n".join(manifest['problems']))
+
+    records = merge_parts(keypoints_parts, keypoints_path)
+    merge_csv(dataset_parts, dataset_path)
+    manifest['keypoints'] = file_entry(keypoints_path, len(records))
+    manifest['dataset'] = file_entry(dataset_path, csv_rows(dataset_path))
+    del records
+
+    write_manifest(manifest, manifest_path)
+    return manifest
@@ -0,0 +1,197 @@
+import cv2
+import json
+import time
+import queue
+import threading
+import collections
+import numpy as np
+
+from scripts.addlogger import calculate_features
+from scripts.posenet import PoseNetDetector
+from scripts.tracker import PoseTracker
+
+# Marks the end of the captured frames
+_DONE = object()
+
+class FrameGrabber:
+    """
+    Class for reading frames from a video file or camera in a background thread.
+
+    When dropping frames, only the newest frames are kept, so a slow consumer always gets the most
+    recent frame instead of falling further and further behind the camera.
+
+    Attributes:
+    - capture (cv2.VideoCapture): Video source.
+    - drop_frames (bool): Whether stale frames are dropped when the consumer falls behind.
+    - fps (float): Rate frames are read at, None to read as fast as the source delivers them.
+    - captured (int): Number of frames read from the source.
+    - dropped (int): Number of frames dropped before they were consumed.
+    """
+
+    def __init__(self, source, drop_frames=True, queue_size=1, fps=None):
+        """
+        Open the video source.
+
+        Parameters:
+        - source (str or int): Path to a video file or index of a camera.
+        - drop_frames (bool): Whether stale frames are dropped when the consumer falls behind.
+        - queue_size (int): Maximum number of frames waiting to be consumed.
+        - fps (float, optional): Rate to read frames at, to replay a video file in real time.
+
+        Returns:
+        - None
+        """
+        self.capture = cv2.VideoCapture(source)
+        if not self.capture.isOpened():
+            raise IOError(f"Cannot open video source {source}")
+
+        self.drop_frames = drop_frames
+        self.fps = fps
+        self.captured = 0
+        self.dropped = 0
+        self._frames = queue.Queue(queue_size)
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _put(self, entry):
+        # Wait for free space, unless the grabber is stopped
+        while not self._stopped.is_set():
+            try:
+                self._frames.put(entry, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def _run(self):
+        start = time.perf_counter()
+        try:
+            while not self._stopped.is_set():
+                if self.fps:
+                    time.sleep(max(start + self.captured / self.fps - time.perf_counter(), 0))
+
+                ok, frame = self.capture.read()
+                if not ok:
+                    break
+                entry = (self.captured, time.perf_counter(), frame)
+                self.captured += 1
+
+                if not self.drop_frames:
+                    self._put(entry)
+                    continue
+
+                # Replace the oldest waiting frame with the new one
+                while True:
+                    try:
+                        self._frames.put_nowait(entry)
+                        break
+                    except queue.Full:
+                        try:
+                            self._frames.get_nowait()
+                            self.dropped += 1
+                        except queue.Empty:
+                            pass
+        finally:
+            self.capture.release()
+            self._put(_DONE)
+
+    def __iter__(self):
+        """
+        Iterate over the captured frames until the source ends.
+
+        Yields:
+        - tuple: Frame index, capture time from time.perf_counter() and the frame.
+        """
+        while True:
+            entry = self._frames.get()
+            if entry is _DONE:
+                return
+            yield entry
+
+def stream_poses(source, model_path=None, num_threads=None, drop_frames=True, fps=None, detector=None, window=30, track_options=None):
+    """
+    Detect poses and calculate torso features on the frames of a video file or camera.
+
+    Frames are captured in a background thread while poses are detected on the newest frame.
+    With tracking options, most frames skip the model and propagate the keypoints with a PoseTracker.
+
+    Parameters:
+    - source (str or int): Path to a video file or index of a camera.
+    - model_path (str, optional): Path to the TensorFlow Lite model file.
+    - num_threads (int, optional): Number of threads used by the interpreter.
+    - drop_frames (bool): Whether stale frames are dropped when detection falls behind the source.
+    - fps (float, optional): Rate to read frames at, to replay a video file in real time.
+    - detector (PoseNetDetector, optional): Detector to use instead of loading model_path.
+    - window (int): Number of recent frames the FPS is measured over.
+    - track_options (dict, optional): Arguments of PoseTracker, None to run the model on every frame.
+
+    Yields:
+    - dict: Frame index, keypoints and features of each detected pose, whether the model ran on the frame,
+      end-to-end latency in milliseconds, FPS, and the number of frames captured and dropped so far.
+    """
+    if detector is None:
+        detector = PoseNetDetector(model_path, num_threads)
+    tracker = PoseTracker(detector, **track_options) if track_options is not None else None
+
+    grabber = FrameGrabber(source, drop_frames, fps=fps).start()
+    times = collections.deque(maxlen=window)
+    try:
+        for index, captured_at, frame in grabber:
+            keypoints = tracker.track(frame) if tracker is not None else detector.detect(frame)
+            features = calculate_features(keypoints)
+
+            now = time.perf_counter()
+            times.append(now)
+            elapsed = times[-1] - times[0]
+
+            yield {
+                'frame': index,
+                'keypoints': keypoints.tolist(),
+                'features': {name: values.tolist() for name, values in features.items()},
+                'detected': tracker.detected if tracker is not None else True,
+                'latency_ms': (now - captured_at) * 1000,
+                'fps': (len(times) - 1) / elapsed if elapsed else None,
+                'captured': grabber.captured,
+                'dropped': grabber.dropped,
+            }
+    finally:
+        grabber.stop()
+
+def write_jsonl(records, file):
+    """
+    Write stream records as JSON lines, flushing after every line so consumers see frames as they come.
+
+    Parameters:
+    - records (iterable): Records as yielded by stream_poses.
+    - file (file object): Open text file to write to.
+
+    Returns:
+    - dict: Number of frames written, mean and 95th percentile latency in milliseconds, the average FPS
+      and the fraction of frames that skipped the model.
+    """
+    latencies = []
+    detections = 0
+    start = time.perf_counter()
+    for record in records:
+        # NaN features of degenerate poses are written as null to keep the lines valid JSON
+        features = {name: [None if np.isnan(value) else value for value in values] for name, values in record['features'].items()}
+        file.write(json.dumps(dict(record, features=features)) + '\n')
+        file.flush()
+        latencies.append(record['latency_ms'])
+        detections += record['detected']
+
+    elapsed = time.perf_counter() - start
+    return {
+        'frames': len(latencies),
+        'mean_latency_ms': float(np.mean(latencies)) if latencies else None,
+        'p95_latency_ms': float(np.percentile(latencies, 95)) if latencies else None,
+        'fps': len(latencies) / elapsed if elapsed else None,
+        'skip_rate': 1 - detections / len(latencies) if latencies else None,
+    }
@@ -0,0 +1,197 @@
+import cv2
+import numpy as np
+
+from scripts.posenet import CONFIDENCE_THRESHOLD
+
+class PoseTracker:
+    """
+    Class for tracking poses over consecutive video frames while skipping most of the model inferences.
+
+    Poses are detected with the full model every interval frames, and on the frames in between
+    the keypoints are propagated with Lucas-Kanade optical flow. A full detection is also run early
+    when the keypoints move too much or too many of them are lost by the optical flow. The output
+    positions are smoothed with an exponential moving average.
+
+    Attributes:
+    - detector (PoseNetDetector): Detector used for the full inferences.
+    - interval (int): Maximum number of frames between full inferences.
+    - max_motion (float): Mean keypoint displacement between frames, relative to the image size, that triggers a full inference.
+    - min_tracked (float): Fraction of the confident keypoints that must still be tracked to skip a full inference.
+    - smoothing (float): Weight of the previous position in the moving average, 0 to disable smoothing.
+    - frames (int): Number of tracked frames.
+    - detections (int): Number of full inferences.
+    - triggers (dict): Number of full inferences caused by the interval, motion and lost keypoints.
+    - detected (bool): Whether the last frame was processed with a full inference.
+    """
+
+    def __init__(self, detector, interval=5, max_motion=0.05, min_tracked=0.6, smoothing=0.5, window=21, levels=3):
+        """
+        Initialize the PoseTracker.
+
+        Parameters:
+        - detector (PoseNetDetector): Detector used for the full inferences.
+        - interval (int): Maximum number of frames between full inferences.
+        - max_motion (float): Mean keypoint displacement between frames, relative to the image size, that triggers a full inference.
+        - min_tracked (float): Fraction of the confident keypoints that must still be tracked to skip a full inference.
+        - smoothing (float): Weight of the previous position in the moving average, 0 to disable smoothing.
+        - window (int): Size of the search window of the optical flow in pixels.
+        - levels (int): Number of pyramid levels of the optical flow.
+
+        Returns:
+        - None
+        """
+        self.detector = detector
+        self.interval = interval
+        self.max_motion = max_motion
+        self.min_tracked = min_tracked
+        self.smoothing = smoothing
+        self.window = (window, window)
+        self.levels = levels
+
+        self.frames = 0
+        self.detections = 0
+        self.triggers = {'interval': 0, 'motion': 0, 'tracking': 0}
+        self.detected = False
+        self.reset()
+
+    def reset(self):
+        """
+        Forget the tracked poses, so the next frame runs a full inference.
+
+        Returns:
+        - None
+        """
+        self._gray = None
+        self._keypoints = None
+        self._confident = None
+        self._detected_confident = None
+        self._smoothed = None
+        self._since_detection = 0
+
+    @property
+    def skip_rate(self):
+        return 1 - self.detections / self.frames if self.frames else 0.0
+
+    def _propagate(self, gray):
+        """
+        Move the confident keypoints of the previous frame to the current frame with optical flow.
+
+        Parameters:
+        - gray (numpy.ndarray): Current frame in grayscale.
+
+        Returns:
+        - tuple: Propagated keypoints of shape (P, 17, 3), or None if a full inference is needed, and the reason for it.
+        """
+        height, width = gray.shape
+        scale = np.array([width, height], dtype=np.float32)
+
+        points = self._keypoints[..., 1::-1] * scale
+        moved, status, _ = cv2.calcOpticalFlowPyrLK(self._gray, gray, points.reshape(-1, 1, 2).astype(np.float32), None,
+                                                    winSize=self.window, maxLevel=self.levels)
+        moved = moved.reshape(points.shape)
+        tracked = status.reshape(points.shape[:-1]).astype(bool) & self._confident
+
+        # Keypoints lost over several frames count against the ones of the last full inference
+        if tracked.sum() < self.min_tracked * self._detected_confident.sum() or not tracked.any():
+            return None, 'tracking'
+
+        displacement = np.linalg.norm((moved - points)[tracked] / scale, axis=-1)
+        if displacement.mean() > self.max_motion:
+            return None, 'motion'
+
+        keypoints = self._keypoints.copy()
+        keypoints[tracked, 1::-1] = moved[tracked] / scale
+        # Keypoints lost by the optical flow are no longer confident
+        keypoints[self._confident & ~tracked, 2] = 0
+        self._confident &= tracked
+        return keypoints, None
+
+    def track(self, frame):
+        """
+        Get the keypoints of the poses on the next frame of a video.
+
+        Parameters:
+        - frame (numpy.ndarray): Next frame of the video.
+
+        Returns:
+        - numpy.ndarray: Array of shape (P, 17, 3) with 'y', 'x' and 'confidence' values for each tracked pose.
+        """
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        self.frames += 1
+
+        keypoints, reason = None, 'interval'
+        if self._keypoints is not None and self._since_detection + 1 < self.interval:
+            keypoints, reason = self._propagate(gray)
+
+        self.detected = keypoints is None
+        if self.detected:
+            keypoints = self.detector.detect(frame).astype(np.float32)
+            self._confident = keypoints[..., 2] > CONFIDENCE_THRESHOLD
+            self._detected_confident = self._confident.copy()
+            self._since_detection = 0
+            self.detections += 1
+            self.triggers[reason] += 1
+            if reason == 'motion':
+                # Do not average over a sudden movement
+                self._smoothed = None
+        else:
+            self._since_detection += 1
+
+        self._gray = gray
+        self._keypoints = keypoints
+
+        # Smooth the positions, restarting when the number of poses changes
+        if self._smoothed is None or self._smoothed.shape != keypoints.shape or not self.smoothing:
+            self._smoothed = keypoints.copy()
+        else:
+            self._smoothed[..., :2] = self.smoothing * self._smoothed[..., :2] + (1 - self.smoothing) * keypoints[..., :2]
+            self._smoothed[..., 2] = keypoints[..., 2]
+        return self._smoothed.copy()
+
+def keypoint_drift(keypoints, reference, threshold=CONFIDENCE_THRESHOLD):
+    """
+    Measure how far tracked keypoints are from the keypoints of a full inference on the same frame.
+
+    Parameters:
+    - keypoints (numpy.ndarray): Tracked keypoints of shape (P, 17, 3).
+    - reference (numpy.ndarray): Detected keypoints of shape (P, 17, 3).
+    - threshold (float): Only keypoints detected with a higher confidence are compared.
+
+    Returns:
+    - float: Mean distance between the keypoints relative to the image size, or NaN if no keypoint is compared.
+    """
+    poses = min(len(keypoints), len(reference))
+    keypoints, reference = keypoints[:poses], reference[:poses]
+    confident = reference[..., 2] > threshold
+    if not confident.any():
+        return np.nan
+    return float(np.linalg.norm(keypoints[..., :2] - reference[..., :2], axis=-1)[confident].mean())
+
+def measure_tracking(frames, detector, **options):
+    """
+    Track poses over a sequence of frames and compare every skipped frame against a full inference.
+
+    Parameters:
+    - frames (iterable): Consecutive video frames.
+    - detector (PoseNetDetector): Detector used for tracking and for the reference inferences.
+    - options: Arguments of PoseTracker.
+
+    Returns:
+    - dict: Number of frames, skip rate, inference triggers and the mean, 95th percentile and maximum drift.
+    """
+    tracker = PoseTracker(detector, **options)
+    drifts = []
+    for frame in frames:
+        keypoints = tracker.track(frame)
+        if not tracker.detected:
+            drifts.append(keypoint_drift(keypoints, detector.detect(frame)))
+
+    drifts = np.array([drift for drift in drifts if not np.isnan(drift)])
+    return {
+        'frames': tracker.frames,
+        'skip_rate': tracker.skip_rate,
+        'triggers': dict(tracker.triggers),
+        'mean_drift': float(drifts.mean()) if len(drifts) else None,
+        'p95_drift': float(np.percentile(drifts, 95)) if len(drifts) else None,
+        'max_drift': float(drifts.max()) if len(drifts) else None,
+    }
@@ -0,0 +1,42 @@
+import argparse
+
+from scripts.posenet import PoseNetDetector
+from scripts.classifier import PostureClassifier
+from scripts.server import create_server
+
+def main(args):
+    """
+    Load the model once and serve pose detection over HTTP until interrupted.
+
+    Parameters:
+    - args (argparse.Namespace): Parsed command line arguments.
+
+    Returns:
+    - None
+    """
+    detector = PoseNetDetector(args.model_path, args.num_threads)
+    classifier = PostureClassifier.load(args.classifier_path) if args.classifier_path is not None else None
+    server = create_server(detector, args.host, args.port, args.batch_size, args.max_wait_ms / 1000, classifier)
+
+    print(f"Serving poses on http://{args.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve PoseNet pose detection over HTTP with request micro-batching.")
+
+    parser.add_argument('--model_path', type=str, default='src/models/PoseNet.tflite', help='Path to the PoseNet TensorFlow Lite model')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='Address to listen on')
+    parser.add_argument('--port', type=int, default=8000, help='Port to listen on')
+    parser.add_argument('--num_threads', type=int, default=None, help='Number of threads used by the TensorFlow Lite interpreter')
+    parser.add_argument('--batch_size', type=int, default=8, help='Maximum number of requests detected in one inference')
+    parser.add_argument('--max_wait_ms', type=float, default=5.0, help='Maximum time a request waits for its batch to fill, in milliseconds')
+    parser.add_argument('--classifier_path', type=str, default=None, help='Optional posture classifier (.npz) to add label probabilities to the responses')
+
+    args = parser.parse_args()
+
+    main(args)
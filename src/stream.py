@@ -0,0 +1,50 @@
+import sys
+import json
+import argparse
+
+from scripts.stream import stream_poses, write_jsonl
+
+def main(args):
+    """
+    Stream per-frame keypoints and torso features of a video file or camera as JSON lines.
+
+    Parameters:
+    - args (argparse.Namespace): Parsed command line arguments.
+
+    Returns:
+    - dict: Summary of the stream with the number of frames, latency and FPS.
+    """
+    # A numeric source is a camera index
+    source = int(args.source) if args.source.isdigit() else args.source
+
+    track_options = None
+    if args.interval > 1:
+        track_options = {'interval': args.interval, 'max_motion': args.max_motion, 'min_tracked': args.min_tracked, 'smoothing': args.smoothing}
+
+    records = stream_poses(source, args.model_path, args.num_threads, not args.no_drop, args.fps, track_options=track_options)
+    if args.output is None:
+        summary = write_jsonl(records, sys.stdout)
+    else:
+        with open(args.output, 'w') as file:
+            summary = write_jsonl(records, file)
+
+    print(json.dumps(summary), file=sys.stderr)
+    return summary
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Detect poses on a video file or camera and stream keypoints and features as JSON lines.")
+
+    parser.add_argument('--source', type=str, default='0', help='Path to a video file or index of a camera')
+    parser.add_argument('--model_path', type=str, required=True, help='Path to the TensorFlow Lite model file')
+    parser.add_argument('--num_threads', type=int, default=None, help='Number of threads used by the interpreter')
+    parser.add_argument('--output', type=str, default=None, help='Path to the JSON lines file, standard output by default')
+    parser.add_argument('--no_drop', action='store_true', help='Process every frame instead of dropping stale frames when detection falls behind')
+    parser.add_argument('--fps', type=float, default=None, help='Rate to read frames at, to replay a video file in real time')
+    parser.add_argument('--interval', type=int, default=1, help='Run the model every N frames and track the keypoints with optical flow in between, 1 to run it on every frame')
+    parser.add_argument('--max_motion', type=float, default=0.05, help='Mean keypoint movement between frames, relative to the image size, that triggers a full inference')
+    parser.add_argument('--min_tracked', type=float, default=0.6, help='Fraction of the confident keypoints that must still be tracked to skip a full inference')
+    parser.add_argument('--smoothing', type=float, default=0.5, help='Weight of the previous position in the moving average of the tracked keypoints, 0 to disable smoothing')
+
+    args = parser.parse_args()
+
+    main(args)
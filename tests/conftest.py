@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The modules are imported as scripts.<name>, the way the command line tools in src import them
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+from scripts.addlogger import (LEFT_HIP, RIGHT_HIP, LEFT_SHOULDER, RIGHT_SHOULDER, calculate_features,
+                               calculate_torso_area, calculate_perpendicular_distance, calculate_angle, process_data,
+                               generate_datasset)
+from scripts.keypointstore import save_keypoints, export_csv, load_keypoints
+
+def torso_points(pose):
+    return [{'y': float(pose[index, 0]), 'x': float(pose[index, 1])} for index in (LEFT_HIP, RIGHT_HIP, LEFT_SHOULDER, RIGHT_SHOULDER)]
+
+def test_features_match_the_scalar_functions():
+    keypoints = np.random.default_rng(0).random((2000, 17, 3))
+
+    features = calculate_features(keypoints)
+
+    for i, pose in enumerate(keypoints):
+        points = torso_points(pose)
+        left, right = calculate_perpendicular_distance(*points)
+        assert features['Torso Area'][i] == pytest.approx(calculate_torso_area(*points), rel=1e-9)
+        assert features['Perpendicular Distance Left Shoulder'][i] == pytest.approx(left, rel=1e-9)
+        assert features['Perpendicular Distance Right Shoulder'][i] == pytest.approx(right, rel=1e-9)
+        assert features['Angle Degree'][i] == pytest.approx(calculate_angle(*points), rel=1e-9, abs=1e-9)
+
+def test_degenerate_poses_are_nan():
+    keypoints = np.random.default_rng(1).random((3, 17, 3))
+    # Vertical hip line
+    keypoints[0, RIGHT_HIP, 1] = keypoints[0, LEFT_HIP, 1]
+    # Parallel hip and shoulder lines
+    keypoints[1, [LEFT_SHOULDER, RIGHT_SHOULDER]] = keypoints[1, [LEFT_HIP, RIGHT_HIP]] + [0.5, 0, 0]
+    # Horizontal hip line
+    keypoints[2, RIGHT_HIP, 0] = keypoints[2, LEFT_HIP, 0]
+
+    features = calculate_features(keypoints)
+
+    with pytest.raises(ZeroDivisionError):
+        calculate_angle(*torso_points(keypoints[0]))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        assert np.isinf(calculate_perpendicular_distance(*torso_points(keypoints[1]))).all()
+    assert np.isnan(features['Perpendicular Distance Left Shoulder'][:2]).all()
+    assert np.isnan(features['Angle Degree'][[0, 2]]).all()
+    assert not np.isnan(features['Torso Area']).any()
+
+def test_process_data_of_nothing_is_empty():
+    assert process_data([]) == []
+
+@pytest.mark.parametrize('extension', ['npy', 'csv'])
+def test_chunked_dataset_matches_a_single_chunk(tmp_path, extension):
+    keypoints = np.random.default_rng(2).random((23, 17, 3), dtype=np.float32)
+    # A degenerate pose gives empty values in the dataset
+    keypoints[4, RIGHT_HIP, 1] = keypoints[4, LEFT_HIP, 1]
+    keypoints_path = str(tmp_path / 'keypoints.npy')
+    save_keypoints(keypoints_path, keypoints, [i % 2 for i in range(23)], [f"{i}.jpg" for i in range(23)])
+    if extension == 'csv':
+        export_csv(load_keypoints(keypoints_path), str(tmp_path / 'keypoints.csv'))
+        keypoints_path = str(tmp_path / 'keypoints.csv')
+
+    assert generate_datasset(keypoints_path, str(tmp_path / 'single.csv'), chunk_size=100) == 23
+    assert generate_datasset(keypoints_path, str(tmp_path / 'chunked.csv'), chunk_size=5) == 23
+
+    single = (tmp_path / 'single.csv').read_text()
+    assert (tmp_path / 'chunked.csv').read_text() == single
+    assert len(single.splitlines()) == 24
+
+def test_empty_store_writes_only_the_header(tmp_path):
+    keypoints_path = str(tmp_path / 'keypoints.npy')
+    save_keypoints(keypoints_path, np.zeros((0, 17, 3)), [], [])
+
+    assert generate_datasset(keypoints_path, str(tmp_path / 'dataset.csv'), chunk_size=5) == 0
+    assert (tmp_path / 'dataset.csv').read_text().splitlines() == [
+        'Torso Area,Perpendicular Distance Left Shoulder,Perpendicular Distance Right Shoulder,Angle Degree,Target']
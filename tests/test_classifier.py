@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+from scripts.addlogger import LEFT_HIP, RIGHT_HIP, calculate_features
+from scripts.classifier import PostureClassifier, feature_matrix
+
+@pytest.fixture
+def poses():
+    keypoints = np.random.default_rng(0).random((500, 17, 3))
+    features = feature_matrix(calculate_features(keypoints))
+    # Larger torsos are labelled 1
+    labels = (features[:, 0] > np.median(features[:, 0])).astype(int)
+    return keypoints, features, labels
+
+def test_fit_separates_the_labels(poses):
+    keypoints, features, labels = poses
+    classifier = PostureClassifier.fit(features, labels)
+
+    assert (classifier.predict(keypoints) == labels).mean() > 0.9
+
+def test_save_and_load_round_trip(poses, tmp_path):
+    keypoints, features, labels = poses
+    classifier = PostureClassifier.fit(features, labels)
+    path = str(tmp_path / 'models' / 'classifier.npz')
+
+    classifier.save(path)
+    loaded = PostureClassifier.load(path)
+
+    np.testing.assert_array_equal(loaded.predict_proba(features), classifier.predict_proba(features))
+
+    np.savez(path, mean=classifier.mean, scale=classifier.scale, weights=classifier.weights, bias=classifier.bias, feature_names=['Other'])
+    with pytest.raises(ValueError, match="different features"):
+        PostureClassifier.load(path)
+
+def test_score_keeps_the_leading_dimensions(poses):
+    keypoints, features, labels = poses
+    classifier = PostureClassifier.fit(features, labels)
+
+    probabilities = classifier.score(keypoints[:24].reshape(4, 6, 17, 3))
+
+    assert probabilities.shape == (4, 6, 2)
+    np.testing.assert_allclose(probabilities.sum(axis=-1), 1)
+    np.testing.assert_allclose(probabilities.reshape(24, 2), classifier.predict_proba(features[:24]))
+    assert classifier.score(keypoints[0]).shape == (2,)
+
+def test_missing_features_are_set_to_the_training_mean(poses):
+    keypoints, features, labels = poses
+    # Poses with a vertical hip line have no distances and no angle
+    keypoints = keypoints.copy()
+    keypoints[:50, RIGHT_HIP, 1] = keypoints[:50, LEFT_HIP, 1]
+    features = feature_matrix(calculate_features(keypoints))
+    assert np.isnan(features[:50, 1:]).all()
+
+    classifier = PostureClassifier.fit(features, labels)
+    probabilities = classifier.score(keypoints[:50])
+
+    assert np.isfinite(classifier.weights).all()
+    assert np.isfinite(probabilities).all()
+    filled = np.where(np.isnan(features[:50]), classifier.mean, features[:50])
+    np.testing.assert_allclose(probabilities, classifier.predict_proba(filled))
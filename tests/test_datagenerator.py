@@ -0,0 +1,89 @@
+import json
+
+import cv2
+import numpy as np
+import pytest
+
+from benchmark import StubInterpreter
+from scripts import posenet
+from scripts.datagenerator import detect_and_save_poses
+from scripts.keypointstore import load_keypoints
+
+class CountingInterpreter(StubInterpreter):
+    # Returns keypoints derived from the input image, and counts the inferences of all instances
+    invocations = 0
+    fail_on = None
+
+    def set_tensor(self, index, value):
+        super().set_tensor(index, value)
+        self._input = value.astype(np.float32)
+
+    def invoke(self):
+        CountingInterpreter.invocations += 1
+        means = self._input.mean(axis=(1, 2, 3))
+        if CountingInterpreter.fail_on is not None and np.isclose(means, CountingInterpreter.fail_on, atol=2).any():
+            raise MemoryError("Out of memory")
+        self._output = means[:, None, None, None] + np.arange(51, dtype=np.float32).reshape(1, 1, 17, 3)
+
+@pytest.fixture
+def dataset(tmp_path, monkeypatch):
+    CountingInterpreter.invocations = 0
+    CountingInterpreter.fail_on = None
+    monkeypatch.setattr(posenet, 'load_interpreter', lambda model_path, num_threads=None: CountingInterpreter())
+
+    for label in range(2):
+        folder = tmp_path / 'input' / str(label)
+        folder.mkdir(parents=True)
+        for i in range(6):
+            cv2.imwrite(str(folder / f"{i}.jpg"), np.full((120, 160, 3), 10 * i + 100 * label, np.uint8))
+
+    model_path = tmp_path / 'model.tflite'
+    model_path.write_bytes(b'model')
+    return tmp_path
+
+def detect(tmp_path, keypoints_name='keypoints.npy', **options):
+    keypoints_path = str(tmp_path / keypoints_name)
+    detect_and_save_poses(str(tmp_path / 'input' / '0'), str(tmp_path / 'input' / '1'), str(tmp_path / 'output'),
+                          str(tmp_path / 'model.tflite'), keypoints_path, batch_size=2, **options)
+    return load_keypoints(keypoints_path)
+
+def test_csv_keypoints_path_is_refused(tmp_path):
+    # The fifth argument used to be the path of keypoints.csv
+    with pytest.raises(ValueError, match=r"\.npy keypoint store"):
+        detect_and_save_poses(str(tmp_path), str(tmp_path), str(tmp_path / 'output'), None, str(tmp_path / 'keypoints.csv'))
+    assert not (tmp_path / 'keypoints.csv').exists()
+
+def test_cached_images_are_not_detected_again(dataset):
+    options = dict(cache_dir=str(dataset / 'cache'), checkpoint_dir=str(dataset / 'checkpoints'))
+    first = np.array(detect(dataset, 'first.npy', **options))
+    assert CountingInterpreter.invocations == 6
+
+    # A second run with the pose-detected images in place is served from the cache
+    second = np.array(detect(dataset, 'second.npy', **options))
+    assert CountingInterpreter.invocations == 6
+    assert first.tobytes() == second.tobytes()
+
+    # Without the pose-detected image, its keypoints are detected again
+    (dataset / 'output' / '1' / '3.jpg').unlink()
+    detect(dataset, 'third.npy', **options)
+    assert CountingInterpreter.invocations == 7
+
+def test_resume_keeps_the_parts_written_before_a_crash(dataset):
+    expected = np.array(detect(dataset, 'expected.npy', checkpoint_dir=str(dataset / 'expected')))
+
+    # The fourth of six batches, with the first image of class 1, fails and the rows of the
+    # batches before it are kept in parts
+    CountingInterpreter.fail_on = 100
+    options = dict(checkpoint_dir=str(dataset / 'checkpoints'), chunk_size=4)
+    with pytest.raises(MemoryError):
+        detect(dataset, **options)
+    with open(dataset / 'checkpoints' / 'detect.jsonl') as file:
+        entries = [json.loads(line) for line in file]
+    assert sum(len(entry['items']) for entry in entries) == 6
+    assert not (dataset / 'keypoints.npy').exists()
+
+    # The resumed run only detects the remaining three batches
+    CountingInterpreter.invocations, CountingInterpreter.fail_on = 0, None
+    resumed = np.array(detect(dataset, resume=True, **options))
+    assert CountingInterpreter.invocations == 3
+    assert resumed.tobytes() == expected.tobytes()
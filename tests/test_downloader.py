@@ -0,0 +1,125 @@
+import hashlib
+
+import httplib2
+import pytest
+from googleapiclient.errors import HttpError
+
+from scripts.downloader import GoogleDriveDownloader, FOLDER_MIME_TYPE
+
+# Drive returns at most this many files per page, whatever pageSize asks for
+PAGE_SIZE = 100
+
+class FakeRequest:
+    def __init__(self, result=None, error=None):
+        self.result = result
+        self.error = error
+
+    def execute(self):
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+class FakeFiles:
+    def __init__(self, drive):
+        self.drive = drive
+
+    def list(self, q, fields, pageSize, pageToken=None):
+        self.drive.list_calls += 1
+        if self.drive.list_failures:
+            self.drive.list_failures -= 1
+            return FakeRequest(error=HttpError(httplib2.Response({'status': 503}), b'Backend Error'))
+
+        folder_id = q.split("'")[1]
+        children = [item for item in self.drive.items.values() if item['parent'] == folder_id]
+        start = int(pageToken or 0)
+        page = {'files': [dict(item) for item in children[start:start + min(pageSize, PAGE_SIZE)]]}
+        if start + PAGE_SIZE < len(children):
+            page['nextPageToken'] = str(start + PAGE_SIZE)
+        return FakeRequest(page)
+
+    def get_media(self, fileId):
+        return fileId
+
+class FakeDrive:
+    """In-memory Drive v3 service, shared by all download threads."""
+
+    def __init__(self):
+        self.items = {}
+        self.contents = {}
+        self.list_calls = 0
+        self.list_failures = 0
+        self.download_failures = {}
+        self.downloads = []
+
+    def add_folder(self, folder_id, name, parent='root'):
+        self.items[folder_id] = {'id': folder_id, 'name': name, 'mimeType': FOLDER_MIME_TYPE, 'parent': parent}
+
+    def add_file(self, file_id, name, content, parent='root'):
+        self.contents[file_id] = content
+        self.items[file_id] = {'id': file_id, 'name': name, 'mimeType': 'image/jpeg', 'parent': parent,
+                               'size': str(len(content)), 'md5Checksum': hashlib.md5(content).hexdigest()}
+
+    def files(self):
+        return FakeFiles(self)
+
+    def download_media(self, request, file, chunk_size):
+        if self.download_failures.get(request):
+            self.download_failures[request] -= 1
+            raise ConnectionResetError('connection reset')
+        self.downloads.append(request)
+        content = self.contents[request]
+        for start in range(0, len(content), chunk_size):
+            file.write(content[start:start + chunk_size])
+            yield min(start + chunk_size, len(content)) / len(content)
+
+def make_downloader(drive):
+    return GoogleDriveDownloader(lambda: drive, backoff=0, download_media=drive.download_media)
+
+def test_sync_lists_all_pages(tmp_path):
+    drive = FakeDrive()
+    drive.add_folder('images', '1')
+    for i in range(250):
+        drive.add_file(f"file{i}", f"img{i}.jpg", f"image {i}".encode(), parent='images')
+
+    result = make_downloader(drive).sync_folder('root', str(tmp_path / 'data'), workers=4, chunk_size=4)
+
+    assert result == {'downloaded': 250, 'skipped': 0}
+    assert len(list((tmp_path / 'data' / '1').iterdir())) == 250
+    assert (tmp_path / 'data' / '1' / 'img249.jpg').read_bytes() == b"image 249"
+
+def test_sync_skips_unchanged_files(tmp_path):
+    drive = FakeDrive()
+    drive.add_file('a', 'a.jpg', b"first")
+    drive.add_file('b', 'b.jpg', b"second")
+    make_downloader(drive).sync_folder('root', str(tmp_path / 'data'))
+
+    # Only the file whose md5Checksum changed on Drive is downloaded again
+    drive.downloads.clear()
+    drive.add_file('b', 'b.jpg', b"changed")
+    result = make_downloader(drive).sync_folder('root', str(tmp_path / 'data'))
+
+    assert result == {'downloaded': 1, 'skipped': 1}
+    assert drive.downloads == ['b']
+    assert (tmp_path / 'data' / 'b.jpg').read_bytes() == b"changed"
+
+def test_sync_retries_transient_errors(tmp_path):
+    drive = FakeDrive()
+    drive.add_file('a', 'a.jpg', b"content")
+    drive.list_failures = 2
+    drive.download_failures['a'] = 2
+
+    result = make_downloader(drive).sync_folder('root', str(tmp_path / 'data'))
+
+    assert result == {'downloaded': 1, 'skipped': 0}
+    assert drive.list_calls == 3
+    assert (tmp_path / 'data' / 'a.jpg').read_bytes() == b"content"
+
+def test_sync_rejects_checksum_mismatch(tmp_path):
+    drive = FakeDrive()
+    drive.add_file('a', 'a.jpg', b"content")
+    drive.contents['a'] = b"corrupted"
+
+    with pytest.raises(OSError, match="Checksum mismatch"):
+        GoogleDriveDownloader(lambda: drive, retries=1, backoff=0, download_media=drive.download_media).sync_folder('root', str(tmp_path / 'data'))
+    assert not (tmp_path / 'data' / 'a.jpg').exists()
+    assert not (tmp_path / 'data' / 'a.jpg.part').exists()
@@ -0,0 +1,46 @@
+import os
+
+import numpy as np
+
+from scripts.datagenerator import augmentation_params
+from scripts.inferencecache import InferenceCache
+
+def write_model(path, content):
+    with open(path, 'wb') as file:
+        file.write(content)
+    return str(path)
+
+def test_key_depends_on_image_model_and_params(tmp_path):
+    cache = InferenceCache(str(tmp_path / 'cache'), write_model(tmp_path / 'a.tflite', b'model a'))
+    other_model = InferenceCache(str(tmp_path / 'cache'), write_model(tmp_path / 'b.tflite', b'model b'))
+
+    key = cache.key(b'image', augmentation_params(5, 0, 1))
+    assert key == cache.key(b'image', augmentation_params(5, 0, 1))
+    assert len({key, cache.key(b'other image', augmentation_params(5, 0, 1)), other_model.key(b'image', augmentation_params(5, 0, 1)),
+                cache.key(b'image', augmentation_params(5, 1, 1)), cache.key(b'image', augmentation_params(5, 0, 2)),
+                cache.key(b'image', augmentation_params(0, 0, 1))}) == 6
+
+def test_get_returns_stored_keypoints(tmp_path):
+    cache = InferenceCache(str(tmp_path / 'cache'), write_model(tmp_path / 'model.tflite', b'model'))
+    keypoints = np.random.default_rng(0).random((2, 17, 3), dtype=np.float32)
+
+    assert cache.get(cache.key(b'image')) is None
+    cache.put(cache.key(b'image'), keypoints)
+    np.testing.assert_array_equal(cache.get(cache.key(b'image')), keypoints)
+
+def test_evict_removes_least_recently_used_entries(tmp_path):
+    cache = InferenceCache(str(tmp_path / 'cache'), write_model(tmp_path / 'model.tflite', b'model'))
+    keys = [cache.key(bytes([i])) for i in range(4)]
+    for age, key in zip((40, 30, 20, 10), keys):
+        cache.put(key, np.zeros((1, 17, 3)))
+        path = cache._path(key)
+        os.utime(path, (os.path.getmtime(path) - age,) * 2)
+    entry_size = os.path.getsize(cache._path(keys[0]))
+
+    # Reading the oldest entry makes it the most recently used one
+    cache.get(keys[0])
+    cache.max_size = 2 * entry_size
+
+    assert cache.evict() == 2
+    assert [cache.get(key) is not None for key in keys] == [True, False, False, True]
+    assert cache.evict() == 0
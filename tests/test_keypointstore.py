@@ -0,0 +1,29 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+
+from scripts.keypointstore import save_keypoints, load_keypoints, keypoint_array, export_csv, read_csv
+
+def test_keypoints_round_trip(tmp_path):
+    keypoints = np.random.default_rng(0).random((5, 17, 3), dtype=np.float32)
+    path = str(tmp_path / 'keypoints.npy')
+
+    save_keypoints(path, keypoints, [0, 1, 0, 1, 1], [f"{i}.jpg" for i in range(5)])
+    records = load_keypoints(path)
+
+    np.testing.assert_array_equal(keypoint_array(records), keypoints)
+    assert records['Nose y'][3] == keypoints[3, 0, 0]
+    assert records['Right Ankle confidence'][4] == keypoints[4, 16, 2]
+    assert list(records['Label']) == [0, 1, 0, 1, 1]
+
+    # The legacy CSV format keeps the values as well
+    csv_path = str(tmp_path / 'keypoints.csv')
+    export_csv(records, csv_path)
+    np.testing.assert_array_equal(keypoint_array(read_csv(csv_path)), keypoints)
+
+def test_stages_without_csv_files_do_not_import_pandas():
+    code = ("import sys; import scripts.checkpoint, scripts.shard, scripts.keypointstore; "
+            "sys.exit('pandas' in sys.modules)")
+    assert subprocess.run([sys.executable, '-c', code], cwd=os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')).returncode == 0
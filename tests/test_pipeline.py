@@ -0,0 +1,37 @@
+import random
+import time
+
+import pytest
+
+from scripts.pipeline import StageTimer, run_pipeline
+
+def sleepy(seconds):
+    time.sleep(random.uniform(0, seconds))
+
+def test_results_are_yielded_in_item_order():
+    timer = StageTimer()
+    results = run_pipeline(range(50), lambda item: sleepy(0.002) or item * 2,
+                           lambda item, data: sleepy(0.002) or data + 1,
+                           lambda item, data, output: sleepy(0.002) or (item, output),
+                           readers=3, writers=3, queue_size=4, timer=timer)
+
+    assert list(results) == [(item, item * 2 + 1) for item in range(50)]
+    assert [timer.stages[stage][0] for stage in ('read', 'process', 'write')] == [50, 50, 50]
+
+def test_results_before_a_failure_are_yielded():
+    def process(item, data):
+        if item == 5:
+            raise RuntimeError("Inference failed")
+        return item
+
+    def write(item, data, output):
+        # Writing is slower than inference, so earlier items are still queued when item 5 fails
+        time.sleep(0.02)
+        return output
+
+    yielded = []
+    with pytest.raises(RuntimeError, match="Inference failed"):
+        for result in run_pipeline(range(10), lambda item: item, process, write, readers=1, writers=1):
+            yielded.append(result)
+
+    assert yielded == [0, 1, 2, 3, 4]
@@ -0,0 +1,94 @@
+import cv2
+import numpy as np
+import pytest
+
+from benchmark import StubInterpreter
+from scripts import posenet
+from scripts.posenet import PoseNetDetector
+
+class FixedBatchInterpreter(StubInterpreter):
+    # Accepts the resized input tensor but fails to allocate it, like a model with a fixed batch size
+    def allocate_tensors(self):
+        if self.input_shape[0] > 1:
+            raise RuntimeError("Cannot allocate a batch of more than one image")
+
+def test_detect_batch_falls_back_to_single_images():
+    detector = PoseNetDetector(None, interpreter=FixedBatchInterpreter())
+    images = [np.zeros((120, 160, 3), np.uint8)] * 3
+
+    keypoints = detector.detect_batch(images)
+
+    assert keypoints.shape == (3, 1, 17, 3)
+    assert not detector.batching
+    assert detector.batch_size == 1
+
+class FixedOutputInterpreter(StubInterpreter):
+    # Accepts a batch but always returns the output of a single image
+    def invoke(self):
+        super().invoke()
+        self._output = self._output[:1]
+
+class FailingInterpreter(StubInterpreter):
+    # Fails every invoke after the first one
+    invocations = 0
+
+    def invoke(self):
+        self.invocations += 1
+        if self.invocations > 1:
+            raise RuntimeError("Inference failed")
+        super().invoke()
+
+def test_output_batch_mismatch_falls_back_to_single_images():
+    detector = PoseNetDetector(None, interpreter=FixedOutputInterpreter())
+    images = [np.zeros((120, 160, 3), np.uint8)] * 3
+
+    assert detector.detect_batch(images).shape == (3, 1, 17, 3)
+    assert not detector.batching
+
+def test_invoke_errors_after_a_working_batch_are_raised():
+    detector = PoseNetDetector(None, interpreter=FailingInterpreter())
+    images = [np.zeros((120, 160, 3), np.uint8)] * 3
+
+    detector.detect_batch(images)
+    with pytest.raises(RuntimeError, match="Inference failed"):
+        detector.detect_batch(images)
+    assert detector.batching
+
+class ImageInterpreter(StubInterpreter):
+    # Returns keypoints derived from each input image and counts the tensor allocations
+    allocations = 0
+
+    def allocate_tensors(self):
+        self.allocations += 1
+
+    def set_tensor(self, index, value):
+        super().set_tensor(index, value)
+        self._input = value.astype(np.float32)
+
+    def invoke(self):
+        self._output = np.broadcast_to(self._input.mean(axis=(1, 2, 3))[:, None, None, None], (len(self._input), 1, 17, 3)).copy()
+
+def test_smaller_batches_are_padded_into_the_reserved_input():
+    interpreter = ImageInterpreter()
+    detector = PoseNetDetector(None, interpreter=interpreter)
+    detector.reserve(8)
+    images = [np.full((120, 160, 3), 10 * i, np.uint8) for i in range(8)]
+
+    for size in (8, 3, 1, 5):
+        keypoints = detector.detect_batch(images[:size])
+        assert keypoints.shape == (size, 1, 17, 3)
+        np.testing.assert_array_equal(keypoints[:, 0, 0, 0], 10 * np.arange(size))
+    assert interpreter.allocations == 2
+    assert detector.batch_size == 8
+
+def test_detect_poses_saves_every_image_in_batches(tmp_path, monkeypatch):
+    monkeypatch.setattr(posenet, 'load_interpreter', lambda model_path, num_threads=None: StubInterpreter())
+    input_folder, output_folder = tmp_path / 'input', tmp_path / 'output'
+    input_folder.mkdir()
+    names = [f"{i}.jpg" for i in range(5)]
+    for name in names:
+        cv2.imwrite(str(input_folder / name), np.zeros((120, 160, 3), np.uint8))
+
+    posenet.detect_poses(str(input_folder), str(output_folder), None, batch_size=2)
+
+    assert sorted(path.name for path in output_folder.iterdir()) == names
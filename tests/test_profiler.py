@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+
+from scripts import profiler
+
+@pytest.fixture
+def profiling(monkeypatch):
+    # Profiling is process-wide, so it is turned off again and its records dropped for the other tests
+    monkeypatch.setattr(profiler, '_enabled', False)
+    monkeypatch.setattr(profiler, '_tracing', False)
+    profiler.collect()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.collect()
+
+def test_samples_are_bounded(profiling):
+    for duration in range(1, 5 * profiler.MAX_SAMPLES + 1):
+        profiler.record('stage', 0, duration * 1000)
+
+    # A worker process reporting a sampled timer of its own
+    worker = profiler._Samples()
+    for duration in range(1, 3 * profiler.MAX_SAMPLES + 1):
+        worker.add(duration * 1000)
+    profiler.merge({'samples': {'stage': worker}, 'counters': {}, 'events': []})
+
+    timer = profiler.report()['timers']['stage']
+    snapshot = profiler.collect()
+    assert len(snapshot['samples']['stage'].durations) == profiler.MAX_SAMPLES
+    assert timer['count'] == 8 * profiler.MAX_SAMPLES
+    assert np.isclose(timer['total_s'], sum(n * (n + 1) / 2 for n in (5 * profiler.MAX_SAMPLES, 3 * profiler.MAX_SAMPLES)) * 1e-6)
+
+    # Durations of 0 to 50 ms and 0 to 30 ms have a merged median of 20 ms
+    assert 18 < timer['p50_ms'] < 22
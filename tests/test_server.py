@@ -0,0 +1,63 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+import pytest
+
+from benchmark import StubInterpreter
+from scripts.posenet import PoseNetDetector
+from scripts.server import create_server
+
+REQUESTS = 32
+
+class CountingInterpreter(StubInterpreter):
+    # Counts the tensor allocations
+    allocations = 0
+
+    def allocate_tensors(self):
+        self.allocations += 1
+
+@pytest.fixture
+def interpreter():
+    return CountingInterpreter(latency=0.002)
+
+@pytest.fixture
+def url(interpreter):
+    detector = PoseNetDetector(None, interpreter=interpreter)
+    server = create_server(detector, port=0, batch_size=8, max_wait=0.02)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def post(url, data):
+    request = urllib.request.Request(f"{url}/detect", data=data, method='POST')
+    with urllib.request.urlopen(request, timeout=10) as response:
+        return response.status, json.load(response)
+
+def test_concurrent_requests_are_batched(url, interpreter):
+    image = cv2.imencode('.jpg', np.zeros((120, 160, 3), np.uint8))[1].tobytes()
+    with ThreadPoolExecutor(REQUESTS) as executor:
+        responses = list(executor.map(lambda _: post(url, image), range(REQUESTS)))
+
+    assert all(status == 200 for status, _ in responses)
+    assert all(np.array(body['keypoints']).shape == (1, 17, 3) for _, body in responses)
+
+    with urllib.request.urlopen(f"{url}/metrics", timeout=10) as response:
+        metrics = json.load(response)
+    assert metrics['requests'] == REQUESTS
+    assert metrics['batches'] < REQUESTS
+    # Once when the detector is created and once for the largest batch, whatever the sizes of the batches
+    assert interpreter.allocations == 2
+
+def test_undecodable_body_is_rejected(url):
+    with pytest.raises(urllib.error.HTTPError) as error:
+        post(url, b'not an image')
+    assert error.value.code == 400
@@ -0,0 +1,42 @@
+import json
+
+import numpy as np
+import pytest
+
+from scripts.keypointstore import save_keypoints, load_keypoints
+from scripts.shard import merge_shards, shard_path
+
+def write_shard(tmp_path, shard, sources, dataset_rows=None):
+    keypoints_path = str(tmp_path / 'keypoints.npy')
+    dataset_path = str(tmp_path / 'dataset.csv')
+    save_keypoints(shard_path(keypoints_path, shard), np.zeros((len(sources), 17, 3)), [0] * len(sources), sources)
+    with open(shard_path(dataset_path, shard), 'w') as file:
+        file.write('Feature,Target\n')
+        for i in range(len(sources) if dataset_rows is None else dataset_rows):
+            file.write(f"{i},0\n")
+    return keypoints_path, dataset_path
+
+def test_merge_concatenates_shards_in_order(tmp_path):
+    write_shard(tmp_path, (0, 2), ['b.jpg', 'd.jpg'])
+    keypoints_path, dataset_path = write_shard(tmp_path, (1, 2), ['a.jpg'])
+
+    manifest = merge_shards(2, keypoints_path, dataset_path)
+
+    assert list(load_keypoints(keypoints_path)['Source']) == ['b.jpg', 'd.jpg', 'a.jpg']
+    assert manifest['problems'] == []
+    assert manifest['keypoints']['rows'] == manifest['dataset']['rows'] == 3
+
+def test_merge_reports_every_problem(tmp_path):
+    write_shard(tmp_path, (0, 3), ['a.jpg', 'b.jpg'], dataset_rows=1)
+    keypoints_path, dataset_path = write_shard(tmp_path, (2, 3), ['c.jpg'], dataset_rows=0)
+    manifest_path = str(tmp_path / 'manifest.json')
+
+    with pytest.raises(ValueError, match="4 problems"):
+        merge_shards(3, keypoints_path, dataset_path, manifest_path)
+
+    with open(manifest_path) as file:
+        problems = json.load(file)['problems']
+    assert len(problems) == 4
+    assert sum('Shard 1/3 is missing' in problem for problem in problems) == 2
+    assert not (tmp_path / 'keypoints.npy').exists()
+    assert not (tmp_path / 'dataset.csv').exists()
@@ -0,0 +1,59 @@
+import io
+import json
+
+import cv2
+import numpy as np
+import pytest
+
+from benchmark import StubInterpreter
+from scripts.posenet import PoseNetDetector
+from scripts.stream import stream_poses, write_jsonl
+
+FRAMES = 60
+
+@pytest.fixture
+def video_path(tmp_path):
+    path = str(tmp_path / 'synthetic.avi')
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), 30, (160, 120))
+    for i in range(FRAMES):
+        writer.write(np.full((120, 160, 3), i * 4, np.uint8))
+    writer.release()
+    return path
+
+def strict_loads(line):
+    # json.loads accepts NaN unless told otherwise, which other JSON parsers reject
+    def reject(constant):
+        raise ValueError(f"invalid JSON constant {constant}")
+    return json.loads(line, parse_constant=reject)
+
+def test_stream_keeps_every_frame_without_dropping(video_path):
+    detector = PoseNetDetector(None, interpreter=StubInterpreter())
+    records = list(stream_poses(video_path, detector=detector, drop_frames=False))
+
+    assert [record['frame'] for record in records] == list(range(FRAMES))
+    assert records[-1]['captured'] == FRAMES
+    assert records[-1]['dropped'] == 0
+
+def test_stream_drops_stale_frames(video_path):
+    # Detection takes longer than the source needs for a frame
+    detector = PoseNetDetector(None, interpreter=StubInterpreter(latency=0.02))
+    records = list(stream_poses(video_path, detector=detector, drop_frames=True, fps=200))
+
+    frames = [record['frame'] for record in records]
+    assert frames == sorted(frames)
+    assert frames[-1] == FRAMES - 1
+    assert records[-1]['dropped'] > 0
+    assert len(records) + records[-1]['dropped'] == records[-1]['captured'] == FRAMES
+
+def test_write_jsonl_writes_nan_as_null(video_path):
+    detector = PoseNetDetector(None, interpreter=StubInterpreter())
+    records = list(stream_poses(video_path, detector=detector, drop_frames=False))
+    records[0]['features'] = {name: [float('nan')] * len(values) for name, values in records[0]['features'].items()}
+
+    file = io.StringIO()
+    stats = write_jsonl(records, file)
+    lines = [strict_loads(line) for line in file.getvalue().splitlines()]
+
+    assert stats['frames'] == len(lines) == FRAMES
+    assert all(value is None for values in lines[0]['features'].values() for value in values)
+    assert lines[0]['features'] and all(values for values in lines[0]['features'].values())
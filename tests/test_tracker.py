@@ -0,0 +1,66 @@
+import cv2
+import numpy as np
+
+from scripts.tracker import PoseTracker, measure_tracking
+
+HEIGHT, WIDTH = 480, 640
+
+class TextureDetector:
+    """Detector of keypoints fixed to a texture that the test moves sideways by shift pixels."""
+
+    def __init__(self):
+        self.shift = 0
+        self.calls = 0
+        rows, columns = np.divmod(np.arange(17), 6)
+        self.keypoints = np.stack([0.3 + 0.15 * rows, 0.15 + 0.09 * columns, np.full(17, 0.9)], axis=-1)[None].astype(np.float32)
+
+    def detect(self, frame):
+        self.calls += 1
+        keypoints = self.keypoints.copy()
+        keypoints[..., 1] += self.shift / WIDTH
+        return keypoints
+
+def texture(seed=0):
+    noise = np.random.default_rng(seed).integers(0, 256, (HEIGHT, WIDTH), dtype=np.uint8)
+    return cv2.cvtColor(cv2.GaussianBlur(noise, (7, 7), 2), cv2.COLOR_GRAY2BGR)
+
+def moving_frames(detector, count, step):
+    image = texture()
+    for i in range(count):
+        detector.shift = i * step
+        yield np.roll(image, detector.shift, axis=1)
+
+def test_slow_motion_is_tracked_between_inferences():
+    detector = TextureDetector()
+    measurement = measure_tracking(moving_frames(detector, 30, 1), detector, interval=5, smoothing=0)
+
+    assert measurement['skip_rate'] == 0.8
+    assert measurement['triggers'] == {'interval': 6, 'motion': 0, 'tracking': 0}
+    assert measurement['max_drift'] < 0.005
+
+def test_fast_motion_triggers_an_inference():
+    detector = TextureDetector()
+    tracker = PoseTracker(detector, interval=100, max_motion=0.005)
+    for frame in moving_frames(detector, 10, 5):
+        tracker.track(frame)
+
+    assert tracker.detections == 10
+    assert tracker.triggers == {'interval': 1, 'motion': 9, 'tracking': 0}
+
+def test_keypoints_lost_one_by_one_trigger_an_inference():
+    detector = TextureDetector()
+    tracker = PoseTracker(detector, interval=100, min_tracked=0.6)
+    frame = texture()
+    tracker.track(frame)
+
+    # Flatten the texture under one more keypoint on every frame, so the optical flow loses it
+    for i in range(8):
+        frame = frame.copy()
+        y, x = int(detector.keypoints[0, i, 0] * HEIGHT), int(detector.keypoints[0, i, 1] * WIDTH)
+        frame[y - 20:y + 21, x - 20:x + 21] = 128
+        tracker.track(frame)
+
+    # 10 of the 17 keypoints of the last inference are not enough, 11 are
+    assert tracker.triggers['tracking'] == 1
+    assert tracker.detected
+    assert tracker.detections == 2